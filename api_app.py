@@ -1,14 +1,74 @@
 # api_app.py
-from fastapi import FastAPI
-from pydantic import BaseModel
-from typing import List
-import pandas as pd
+from fastapi import FastAPI, Header, HTTPException, Query, Request
+from fastapi.responses import JSONResponse, Response, StreamingResponse
+from pydantic import BaseModel, ValidationError
+from typing import Literal, Optional, Union
+from contextlib import asynccontextmanager
+from datetime import date as Date, datetime, timedelta
+import asyncio
+import base64
+import csv
+import hashlib
+import json
 import os
+import secrets
 from fastapi.middleware.cors import CORSMiddleware
+from appointment_store import open_store, migrate, parse_date, CALLBACK_STORE
+from group_commit import GroupCommitter
+from occupancy import OccupancyIndex, SlotTaken, AlreadyBooked
+from schedule import load_schedule, Availability, NotInSchedule
+from idempotency import IdempotencyIndex, DuplicateRequest, fingerprint, without_key, KEY_FIELD
+from snapshot import ListingSnapshot
+from lookup_index import PatientIndex
+from stats import BookingStats
+from session_store import SessionStore
+import booking_flow
+import metrics
+from reminders import ReminderScheduler, open_sender
 
-API_CSV = "appointments.csv"
+# Append-only appointment store (imports the old appointments.csv once) and
+# a separate one for expert-callback requests
+store = open_store()
+callback_store = open_store(CALLBACK_STORE)
+occupancy = OccupancyIndex()
+idempotency = IdempotencyIndex()
+listing = ListingSnapshot()
+patients = PatientIndex()
+stats = BookingStats()
+availability = Availability(load_schedule(), occupancy)
+store.add_listener(occupancy)
+store.add_listener(idempotency)
+store.add_listener(listing)
+store.add_listener(patients)
+store.add_listener(availability)
+store.add_listener(stats)
+callback_store.add_listener(stats)
+# Appointment reminders can run inside the API (REMINDERS=1) instead of as
+# the standalone `python reminders.py`; only one of them per deployment
+reminders = ReminderScheduler(store, open_sender()) if os.getenv("REMINDERS", "").lower() in ["1","true","yes"] else None
+if reminders is not None:
+    store.add_listener(reminders)
+migrate(store, callback_store)
+store.load()
+callback_store.load()
+availability.precompute()
 
-app = FastAPI(title="Appointment API")
+# Single writer: concurrent POSTs are batched into one durable write, and
+# retries and double bookings are rejected under the store lock
+committer = GroupCommitter(store, checks=[idempotency.check, occupancy.check])
+callback_committer = GroupCommitter(callback_store)
+
+@asynccontextmanager
+async def lifespan(app):
+    if reminders is not None:
+        reminders.start()
+    yield
+    if reminders is not None:
+        reminders.stop()
+    committer.close()
+    callback_committer.close()
+
+app = FastAPI(title="Appointment API", lifespan=lifespan)
 
 # Add CORS middleware
 app.add_middleware(
@@ -19,14 +79,9 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
-# Ensure file exists
-if not os.path.exists(API_CSV):
-    df_init = pd.DataFrame(columns=[
-        "first_name","last_name","sex","mobile","dob","email",
-        "partner_included","partner_first","partner_last","department",
-        "doctor","date","time_slot","reason","summary"
-    ])
-    df_init.to_csv(API_CSV, index=False)
+# Latency per endpoint, plus opt-in request profiles (see metrics.py)
+app.add_middleware(metrics.MetricsMiddleware)
+metrics.gauge("idempotency_keys", "Idempotency keys currently remembered", lambda: len(idempotency))
 
 class Appointment(BaseModel):
     first_name: str
@@ -45,18 +100,446 @@ class Appointment(BaseModel):
     reason: str
     summary: str = ""
 
-@app.get("/api/appointments", response_model=List[Appointment])
-def get_appointments():
-    df = pd.read_csv(API_CSV)
-    return df.to_dict(orient="records")
+class CallbackRequest(BaseModel):
+    name: str
+    phone: str
+    email: str = ""
+    preference: str = ""
+    type: Literal["expert_callback"] = "expert_callback"
+
+# ---------- Listing helpers ----------
+# A cursor is the store locator of the next record to return, so resuming a
+# page is a seek, not a re-scan of everything before it. Cursors come back
+# from clients, so one that isn't a locator of that store is rejected.
+def _encode_cursor(loc):
+    return base64.urlsafe_b64encode(json.dumps(loc).encode()).decode()
+
+def _decode_cursor(cursor, store):
+    try:
+        loc = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+    except ValueError:
+        loc = None
+    if loc is None or not store.valid_locator(loc):
+        raise HTTPException(status_code=422, detail="Invalid cursor")
+    return loc
+
+def _date_param(value, name):
+    if value is None:
+        return None
+    day = parse_date(value)
+    if day is None:
+        raise HTTPException(status_code=422, detail=f"{name} must be DD/MM/YYYY or YYYY-MM-DD")
+    return day
+
+# created_at bounds; a bare date as upper bound covers that whole day
+def _created_param(value, name, upper=False):
+    if value is None:
+        return None
+    try:
+        moment = datetime.fromisoformat(value)
+    except ValueError:
+        raise HTTPException(status_code=422, detail=f"{name} must be an ISO date or datetime")
+    if upper and len(value) == 10:
+        moment += timedelta(days=1)
+    return moment.isoformat()
+
+def _record_filter(doctor, department, type, date_from, date_to, created_from, created_to):
+    def matches(r):
+        if type and r.get("type") != type:
+            return False
+        if doctor and r.get("doctor") != doctor:
+            return False
+        if department and r.get("department") != department:
+            return False
+        if date_from or date_to:
+            day = parse_date(r.get("date"))
+            if day is None or (date_from and day < date_from) or (date_to and day > date_to):
+                return False
+        created = r.get("created_at") or ""
+        if created_from and created < created_from:
+            return False
+        if created_to and created >= created_to:
+            return False
+        return True
+    return matches
+
+# Yields NDJSON in chunks of NDJSON_CHUNK records: a sync iterator is
+# advanced in a worker thread, so this is one thread hop per chunk rather
+# than per record
+NDJSON_CHUNK = 500
+
+def _ndjson_rows(rows):
+    chunk = []
+    for r in rows:
+        chunk.append(json.dumps(r, ensure_ascii=False) + "\n")
+        if len(chunk) == NDJSON_CHUNK:
+            yield "".join(chunk)
+            chunk = []
+    if chunk:
+        yield "".join(chunk)
+
+# Up to limit matching records from the cursor on (all of them without a
+# limit) and the cursor of the next one. Checking the cursor and scanning
+# both read the store files, so endpoints run it in a thread. Every listing
+# hands records out through without_key().
+def _page(store, cursor, matches, limit, date_from=None, date_to=None):
+    start = _decode_cursor(cursor, store) if cursor else None
+    rows, next_cursor = [], None
+    for loc, r in store.scan(start, date_from, date_to):
+        if not matches(r):
+            continue
+        if limit is not None and len(rows) == limit:
+            next_cursor = _encode_cursor(loc)
+            break
+        rows.append(without_key(r))
+    return rows, next_cursor
+
+# Endpoints are async: store reads run in worker threads (asyncio.to_thread)
+# and commits are awaited, so no thread is held while a batch is written
+@app.get("/api/appointments")
+async def get_appointments(
+    doctor: Optional[str] = None,
+    department: Optional[str] = None,
+    date_from: Optional[str] = None,
+    date_to: Optional[str] = None,
+    created_from: Optional[str] = None,
+    created_to: Optional[str] = None,
+    type: Optional[str] = "appointment",
+    limit: Optional[int] = Query(None, ge=1, le=1000),
+    cursor: Optional[str] = None,
+    format: str = Query("json", pattern="^(json|ndjson)$"),
+    if_none_match: Optional[str] = Header(None),
+):
+    # The full listing is streamed from the in-memory snapshot (in a worker
+    # thread, like any sync iterator); a client that already has this
+    # version gets a bodiless 304
+    if (type == "appointment" and format == "json" and limit is None and cursor is None
+            and not any((doctor, department, date_from, date_to, created_from, created_to))):
+        await asyncio.to_thread(store.refresh)
+        etag, length, body = listing.body()
+        if if_none_match and etag in [t.strip() for t in if_none_match.split(",")]:
+            return Response(status_code=304, headers={"ETag": etag})
+        return StreamingResponse(body, media_type="application/json",
+                                 headers={"ETag": etag, "Content-Length": str(length)})
 
+    date_from, date_to = _date_param(date_from, "date_from"), _date_param(date_to, "date_to")
+    matches = _record_filter(
+        doctor, department, type, date_from, date_to,
+        _created_param(created_from, "created_from"), _created_param(created_to, "created_to", upper=True),
+    )
+    # NDJSON export streams straight off the store at constant memory. A
+    # date range only opens the partitions (months) it covers.
+    if format == "ndjson" and limit is None:
+        start = await asyncio.to_thread(_decode_cursor, cursor, store) if cursor else None
+        rows = (without_key(r) for _, r in store.scan(start, date_from, date_to) if matches(r))
+        return StreamingResponse(_ndjson_rows(rows), media_type="application/x-ndjson")
+
+    rows, next_cursor = await asyncio.to_thread(_page, store, cursor, matches, limit, date_from, date_to)
+    headers = {"X-Next-Cursor": next_cursor} if next_cursor else {}
+    if format == "ndjson":
+        return StreamingResponse(_ndjson_rows(rows), media_type="application/x-ndjson", headers=headers)
+    return JSONResponse(content=rows, headers=headers)
+
+# Front-desk lookup by phone, email or full name (criteria are ANDed)
+@app.get("/api/appointments/lookup")
+async def lookup_appointments(
+    mobile: Optional[str] = None,
+    email: Optional[str] = None,
+    first_name: Optional[str] = None,
+    last_name: Optional[str] = None,
+):
+    if (first_name is None) != (last_name is None):
+        raise HTTPException(status_code=422, detail="Name lookup needs both first_name and last_name")
+    if mobile is None and email is None and first_name is None:
+        raise HTTPException(status_code=422, detail="Give mobile, email or first_name and last_name")
+    def rows():
+        store.refresh()
+        return [without_key(store.read_at(loc)) for loc in patients.find(mobile, email, first_name, last_name)]
+    return JSONResponse(content=await asyncio.to_thread(rows))
+
+def _replayed(e):
+    if not e.same_payload:
+        raise HTTPException(status_code=422, detail="Idempotency-Key was already used for a different appointment")
+    return JSONResponse(status_code=200, content={"status":"ok", "message":"appointment already saved"},
+                        headers={"Idempotent-Replayed": "true"})
+
+# Retries carry the same Idempotency-Key (or, without one, the same content)
+# and are answered from the idempotency index without touching the store
 @app.post("/api/appointments", status_code=201)
-def create_appointment(appt: Appointment):
-    df = pd.read_csv(API_CSV)
-    df = pd.concat([df, pd.DataFrame([appt.dict()])], ignore_index=True)
-    df.to_csv(API_CSV, index=False)
+async def create_appointment(appt: Appointment, idempotency_key: Optional[str] = Header(None, max_length=255)):
+    record = appt.model_dump()
+    record[KEY_FIELD] = idempotency_key or fingerprint(record)
+    try:
+        idempotency.lookup(record)
+        # Acknowledge only once the batch holding this record is on disk
+        await committer.commit_async(record)
+    except DuplicateRequest as e:
+        return _replayed(e)
+    except SlotTaken as e:
+        raise HTTPException(status_code=409, detail=str(e))
+    except AlreadyBooked:
+        return JSONResponse(status_code=200, content={"status":"ok", "message":"appointment already saved"})
     return {"status":"ok", "message":"appointment saved"}
 
+# ---------- Bulk ingestion ----------
+BULK_MAX_RECORDS = 50000
+NDJSON_TYPES = ("application/x-ndjson", "application/ndjson", "application/jsonl")
+
+def _parse_line(line):
+    try:
+        return json.loads(line)
+    except ValueError as e:
+        return ValueError(f"Invalid JSON: {e}")
+
+# Lines of the body as they arrive (newline kept), so large uploads are
+# parsed in bounded memory
+async def _body_lines(request):
+    pending = b""
+    async for chunk in request.stream():
+        pending += chunk
+        *lines, pending = pending.split(b"\n")
+        for line in lines:
+            yield line + b"\n"
+    if pending:
+        yield pending
+
+# CSV records as text: lines are joined while a quoted field spans them
+async def _csv_records(request):
+    record = ""
+    async for line in _body_lines(request):
+        record += line.decode("utf-8")
+        if record.count('"') % 2 == 0:
+            yield record
+            record = ""
+    if record:
+        yield record
+
+# Yields one decoded object per record (or the ValueError for a bad line).
+# NDJSON and CSV are parsed as they arrive; JSON arrays in one go.
+async def _bulk_items(request):
+    ctype = request.headers.get("content-type", "").split(";")[0].strip().lower()
+    if ctype in NDJSON_TYPES:
+        async for line in _body_lines(request):
+            if line.strip():
+                yield _parse_line(line)
+    elif ctype == "text/csv":
+        header = None
+        async for text in _csv_records(request):
+            for row in csv.reader([text]):
+                if not row:
+                    continue
+                if header is None:
+                    header = [row[0].lstrip("\ufeff")] + row[1:]
+                    continue
+                yield {k: v for k, v in zip(header, row) if k and v}
+    else:
+        try:
+            items = json.loads(await request.body())
+        except ValueError:
+            raise HTTPException(status_code=400, detail="Body must be a JSON array, NDJSON or CSV")
+        if not isinstance(items, list):
+            raise HTTPException(status_code=422, detail="JSON body must be an array of records")
+        for item in items:
+            yield item
+
+def _validate_record(obj):
+    if isinstance(obj, Exception):
+        raise obj
+    if not isinstance(obj, dict):
+        raise ValueError("Record must be a JSON object")
+    if obj.get("type") == "expert_callback":
+        return CallbackRequest.model_validate(obj).model_dump()
+    return Appointment.model_validate(obj).model_dump()
+
+def _errors(e):
+    if isinstance(e, ValidationError):
+        return [{"loc": list(err["loc"]), "msg": err["msg"]} for err in e.errors()]
+    return [{"loc": [], "msg": str(e)}]
+
+# Appointments and callback requests (type "expert_callback") as a JSON array,
+# NDJSON or CSV. Valid records are committed in one batch per store (one
+# write, one fsync); the response reports the outcome of each record by
+# position.
+@app.post("/api/appointments/bulk")
+async def bulk_create(request: Request):
+    results, records, positions = [], [], []
+    callbacks, callback_positions = [], []
+    async for obj in _bulk_items(request):
+        index = len(results)
+        if index >= BULK_MAX_RECORDS:
+            raise HTTPException(status_code=413, detail=f"At most {BULK_MAX_RECORDS} records per request")
+        try:
+            record = _validate_record(obj)
+        except ValueError as e:
+            results.append({"index": index, "status": "invalid", "errors": _errors(e)})
+            continue
+        if record.get("type") == "expert_callback":
+            callbacks.append(record)
+            callback_positions.append(index)
+        else:
+            records.append(record)
+            positions.append(index)
+        results.append(None)
+
+    futures = committer.submit_many(records) + callback_committer.submit_many(callbacks)
+    positions += callback_positions
+    outcomes = await asyncio.gather(*(asyncio.wrap_future(f) for f in futures), return_exceptions=True)
+    for index, outcome in zip(positions, outcomes):
+        if isinstance(outcome, SlotTaken):
+            results[index] = {"index": index, "status": "conflict", "detail": str(outcome)}
+        elif isinstance(outcome, AlreadyBooked):
+            results[index] = {"index": index, "status": "duplicate"}
+        elif isinstance(outcome, Exception):
+            raise HTTPException(status_code=503, detail=f"Batch could not be committed: {outcome}")
+        else:
+            results[index] = {"index": index, "status": "created"}
+
+    counts = {}
+    for r in results:
+        counts[r["status"]] = counts.get(r["status"], 0) + 1
+    return {"received": len(results), "counts": counts, "results": results}
+
+# ---------- Expert callbacks ----------
+@app.get("/api/callbacks")
+async def get_callbacks(
+    created_from: Optional[str] = None,
+    created_to: Optional[str] = None,
+    limit: Optional[int] = Query(None, ge=1, le=1000),
+    cursor: Optional[str] = None,
+):
+    matches = _record_filter(
+        None, None, None, None, None,
+        _created_param(created_from, "created_from"), _created_param(created_to, "created_to", upper=True),
+    )
+    rows, next_cursor = await asyncio.to_thread(_page, callback_store, cursor, matches, limit)
+    headers = {"X-Next-Cursor": next_cursor} if next_cursor else {}
+    return JSONResponse(content=rows, headers=headers)
+
+@app.post("/api/callbacks", status_code=201)
+async def create_callback(callback: CallbackRequest):
+    await callback_committer.commit_async(callback.model_dump())
+    return {"status":"ok", "message":"callback request saved"}
+
+# Doctor directory plus free slots: pass date (or date_from/date_to) to get
+# availability windows for those days; date_to alone means from today
+@app.get("/api/availability")
+async def get_availability(
+    department: Optional[str] = None,
+    doctor: Optional[str] = None,
+    date: Optional[str] = None,
+    date_from: Optional[str] = None,
+    date_to: Optional[str] = None,
+):
+    date_from = _date_param(date or date_from, "date")
+    date_to = _date_param(date_to, "date_to")
+    if date_to and not date_from:
+        date_from = Date.today()
+    if date_from and date_to and date_to < date_from:
+        raise HTTPException(status_code=422, detail="date_to is before date_from")
+    if date_from and date_to and (date_to - date_from).days > availability.horizon_days:
+        raise HTTPException(status_code=422, detail=f"Date range is limited to {availability.horizon_days} days")
+    await asyncio.to_thread(store.refresh)
+    try:
+        return availability.query(department, doctor, date_from, date_to)
+    except NotInSchedule as e:
+        raise HTTPException(status_code=404, detail=f"Not in schedule: {e.args[0]}")
+
+# ---------- Booking sessions ----------
+# The chatbot's booking conversation (booking_flow) for any client: WhatsApp,
+# a web widget or a load test drive it one input at a time. Session states
+# are small dicts in a SessionStore (SQLite), so every worker of a
+# `uvicorn --workers N` deployment sees every session; they go once idle for
+# SESSION_TTL seconds.
+SESSION_TTL = int(os.getenv("SESSION_TTL", 3600))
+BOOKING_SESSION_DB = os.getenv("BOOKING_SESSION_DB", "booking_sessions.sqlite3")
+sessions = SessionStore(BOOKING_SESSION_DB, idle_ttl=SESSION_TTL)
+metrics.gauge("booking_sessions", "Booking sessions stored", lambda: len(sessions))
+
+class SessionInput(BaseModel):
+    action: Literal["answer", "back", "goto", "confirm", "cancel"] = "answer"
+    value: Optional[Union[str, int]] = None
+
+# Options of the choice steps, straight from the schedule and availability
+def _options(field, form):
+    schedule = availability.schedule
+    if field == "department":
+        return schedule.departments
+    if field == "doctor":
+        return schedule.doctors_by_department.get(form.get("department"), [])
+    if field == "time_slot":
+        day = parse_date(form.get("date"))
+        if day is None or form.get("doctor") not in schedule.department_of:
+            return []
+        return availability.free_slots(form["doctor"], day)
+    return []
+
+async def _session(session_id):
+    state = await asyncio.to_thread(sessions.load, session_id)
+    if state is None:
+        raise HTTPException(status_code=404, detail="Unknown or expired session")
+    return state
+
+def _session_response(session_id, state, prompt, errors=()):
+    return {"session_id": session_id, "state": state, "prompt": prompt, "errors": list(errors)}
+
+@app.post("/api/sessions", status_code=201)
+async def create_session():
+    session_id = secrets.token_urlsafe(16)
+    state = booking_flow.start()
+    await asyncio.to_thread(sessions.save, session_id, state)
+    return _session_response(session_id, state, booking_flow.prompt(state, _options))
+
+@app.get("/api/sessions/{session_id}")
+async def get_session(session_id: str):
+    state = await _session(session_id)
+    return _session_response(session_id, state, booking_flow.prompt(state, _options))
+
+# Confirming commits the booking with an idempotency key derived from the
+# session id, so a retried confirm never books twice. It is a hash: the key
+# is stored with the record and the session id is the only credential.
+@app.post("/api/sessions/{session_id}/input")
+async def session_input(session_id: str, body: SessionInput):
+    state, prompt, errors = booking_flow.advance(await _session(session_id), body.model_dump(), _options)
+    if not errors and state["status"] == booking_flow.CONFIRMED:
+        record = booking_flow.booking_record(state["form"])
+        record[KEY_FIELD] = "session:" + hashlib.sha256(session_id.encode()).hexdigest()
+        try:
+            await committer.commit_async(record)
+        except (DuplicateRequest, AlreadyBooked):
+            pass
+        except SlotTaken:
+            state, prompt, errors = booking_flow.slot_taken(state, _options)
+    await asyncio.to_thread(sessions.save, session_id, state)
+    return _session_response(session_id, state, prompt, errors)
+
+@app.delete("/api/sessions/{session_id}", status_code=204)
+async def delete_session(session_id: str):
+    await _session(session_id)
+    await asyncio.to_thread(sessions.delete, session_id)
+
+# Live booking counts. by_day covers date_from..date_to (default: the last
+# 30 days through the availability horizon).
+STATS_MAX_DAYS = 366
+
+def _refresh_stores():
+    store.refresh()
+    callback_store.refresh()
+
+@app.get("/api/stats")
+async def get_stats(date_from: Optional[str] = None, date_to: Optional[str] = None):
+    today = Date.today()
+    date_from = _date_param(date_from, "date_from") or today - timedelta(days=30)
+    date_to = _date_param(date_to, "date_to") or today + timedelta(days=availability.horizon_days)
+    if (date_to - date_from).days > STATS_MAX_DAYS:
+        raise HTTPException(status_code=422, detail=f"Date range is limited to {STATS_MAX_DAYS} days")
+    await asyncio.to_thread(_refresh_stores)
+    return stats.snapshot(date_from, date_to)
+
+# Prometheus scrape endpoint
+@app.get("/metrics", include_in_schema=False)
+async def get_metrics():
+    return Response(content=metrics.render(), media_type=metrics.CONTENT_TYPE)
+
 @app.get("/")
-def read_root():
+async def read_root():
     return {"message": "Appointment API is running"}
\ No newline at end of file
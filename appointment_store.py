@@ -0,0 +1,614 @@
+# appointment_store.py
+import bisect
+import csv
+import json
+import os
+import threading
+from contextlib import contextmanager
+from datetime import date, datetime
+from functools import lru_cache, wraps
+from filelock import FileLock
+import metrics
+
+# ---------- Configuration ----------
+LEGACY_CSV = "appointments.csv"
+LEGACY_LOG = "appointments.jsonl"
+DEFAULT_STORE = os.getenv("APPT_STORE", "partitioned:appointments")
+CALLBACK_STORE = os.getenv("CALLBACK_STORE", "jsonl:callbacks.jsonl")
+
+STORE_SECONDS = metrics.histogram("store_operation_seconds", "Time spent in store reads and writes", ("store", "op"))
+
+
+# Times a store method (for scan, only the time spent reading records)
+def _timed(op):
+    def decorate(fn):
+        @wraps(fn)
+        def timed(self, *args, **kwargs):
+            if op == "scan":
+                return metrics.timed_iter(STORE_SECONDS, fn(self, *args, **kwargs),
+                                          span=f"{self.name}_{op}", store=self.name, op=op)
+            with metrics.timer(STORE_SECONDS, span=f"{self.name}_{op}", store=self.name, op=op):
+                return fn(self, *args, **kwargs)
+        return timed
+    return decorate
+
+
+# ---------- Store interface ----------
+# A store is an append-only sequence of records. Every record gets a locator
+# (opaque to callers) that can be used to read it back or resume a scan.
+# Listeners are called with [(locator, record), ...] for every batch that
+# lands in the store, including batches written by other processes.
+class AppointmentStore:
+    def __init__(self, name="store"):
+        self.name = name
+        self._listeners = []
+
+    def add_listener(self, fn):
+        self._listeners.append(fn)
+
+    def _notify(self, entries):
+        if not entries:
+            return
+        for fn in self._listeners:
+            fn(entries)
+
+    def append(self, record):
+        return self.append_many([record])[0]
+
+    # stamp=False keeps a missing created_at missing (imported history)
+    def append_many(self, records, stamp=True):
+        raise NotImplementedError
+
+    # date_from/date_to are a hint: a store may skip records it knows fall
+    # outside the range, callers still filter what comes back
+    def scan(self, start=None, date_from=None, date_to=None):
+        raise NotImplementedError
+
+    def read_at(self, loc):
+        raise NotImplementedError
+
+    # Whether loc, decoded from a client's cursor and so untrusted, is a
+    # locator this store hands out (a record boundary)
+    def valid_locator(self, loc):
+        raise NotImplementedError
+
+    def load(self):
+        # Replay the whole store to the listeners (once, at startup)
+        raise NotImplementedError
+
+    def refresh(self):
+        # Pick up records appended by other processes since the last look
+        raise NotImplementedError
+
+    @contextmanager
+    def locked(self):
+        # Exclusive access across threads and processes, caught up with
+        # every committed record, for check-then-append sequences
+        raise NotImplementedError
+
+
+# Appointment dates are typed as DD/MM/YYYY in the chat; accept ISO too
+DATE_FORMATS = ["%d/%m/%Y", "%Y-%m-%d"]
+
+def parse_date(value):
+    value = str(value or "").strip()
+    for fmt in DATE_FORMATS:
+        try:
+            return datetime.strptime(value, fmt).date()
+        except ValueError:
+            pass
+    return None
+
+
+# A record as it is stored: no None values, a type, and the appointment
+# date in ISO form
+def normalize(record):
+    record = {k: v for k, v in dict(record).items() if v is not None}
+    record.setdefault("type", "appointment")
+    day = parse_date(record.get("date"))
+    if day is not None:
+        record["date"] = day.isoformat()
+    return record
+
+def _stamp(record, stamp=True):
+    record = normalize(record)
+    if stamp and not record.get("created_at"):
+        record["created_at"] = datetime.now().isoformat()
+    return record
+
+# A crash mid-write can leave a partial last line; cut it off so the next
+# append starts on a fresh line.
+def _repair_tail(path):
+    size = os.path.getsize(path)
+    if size == 0:
+        return
+    with open(path, "rb+") as f:
+        f.seek(max(0, size - 65536))
+        tail = f.read()
+        if tail.endswith(b"\n"):
+            return
+        cut = tail.rfind(b"\n")
+        f.truncate(size - len(tail) + cut + 1 if cut >= 0 else 0)
+
+# (offset + base, record) for every complete line from byte offset start on,
+# read lazily
+def _iter_lines(path, start=0, base=0):
+    with open(path, "rb") as f:
+        f.seek(start)
+        offset = start
+        for line in f:
+            if not line.endswith(b"\n"):
+                break
+            yield base + offset, json.loads(line)
+            offset += len(line)
+
+# Whether offset is where a line starts (or the end of the file)
+def _line_start(path, offset):
+    if offset == 0:
+        return True
+    with open(path, "rb") as f:
+        f.seek(offset - 1)
+        return f.read(1) == b"\n"
+
+# The same as a list, plus the offset after the last complete line
+def _read_lines(path, start=0, base=0):
+    entries = []
+    with open(path, "rb") as f:
+        f.seek(start)
+        offset = start
+        for line in f:
+            if not line.endswith(b"\n"):
+                break
+            entries.append((base + offset, json.loads(line)))
+            offset += len(line)
+    return entries, offset
+
+
+# ---------- JSON lines log ----------
+# One JSON object per line, opened in append mode: a write costs O(record)
+# no matter how many rows are already stored, and the file is never rewritten.
+# A process-wide lock plus a file lock keep writers from interleaving.
+class JsonlLogStore(AppointmentStore):
+    def __init__(self, path):
+        super().__init__(os.path.splitext(os.path.basename(path))[0])
+        self.path = path
+        self._lock = threading.RLock()
+        self._file_lock = FileLock(path + ".lock")
+        self._end = 0
+        if not os.path.exists(path):
+            open(path, "ab").close()
+        with self._lock, self._file_lock:
+            _repair_tail(path)
+
+    def _sync(self):
+        entries, self._end = _read_lines(self.path, self._end)
+        self._notify(entries)
+
+    @_timed("load")
+    def load(self):
+        with self._lock:
+            self._sync()
+
+    @_timed("refresh")
+    def refresh(self):
+        with self._lock:
+            if os.path.getsize(self.path) != self._end:
+                self._sync()
+
+    @contextmanager
+    def locked(self):
+        with self._lock, self._file_lock:
+            self._sync()
+            yield
+
+    @_timed("append")
+    def append_many(self, records, stamp=True):
+        records = [_stamp(r, stamp) for r in records]
+        if not records:
+            return []
+        lines = [(json.dumps(r, ensure_ascii=False) + "\n").encode("utf-8") for r in records]
+        with self._lock, self._file_lock:
+            self._sync()
+            with open(self.path, "ab") as f:
+                f.write(b"".join(lines))
+                f.flush()
+                os.fsync(f.fileno())
+            locs = []
+            for line in lines:
+                locs.append(self._end)
+                self._end += len(line)
+            self._notify(list(zip(locs, records)))
+        return locs
+
+    @_timed("scan")
+    def scan(self, start=None, date_from=None, date_to=None):
+        return _iter_lines(self.path, start or 0)
+
+    @_timed("read")
+    def read_at(self, loc):
+        with open(self.path, "rb") as f:
+            f.seek(loc)
+            return json.loads(f.readline())
+
+    def valid_locator(self, loc):
+        return type(loc) is int and loc >= 0 and _line_start(self.path, loc)
+
+    # Drop every record keep() rejects by writing a new file and swapping it
+    # in. Locators change, so this is only for one-shot migrations that run
+    # before load().
+    def rewrite(self, keep):
+        tmp = self.path + ".tmp"
+        with self._lock, self._file_lock:
+            with open(self.path, "rb") as src, open(tmp, "wb") as dst:
+                for line in src:
+                    if line.endswith(b"\n") and keep(json.loads(line)):
+                        dst.write(line)
+                dst.flush()
+                os.fsync(dst.fileno())
+            os.replace(tmp, self.path)
+            self._end = 0
+
+
+# ---------- Date-partitioned log ----------
+UNDATED = "undated"
+
+# Partition of a record: its appointment month (YYYY-MM), or "undated"
+def partition_of(record):
+    day = parse_date(record.get("date"))
+    return f"{day:%Y-%m}" if day else UNDATED
+
+def _month_range(date_from, date_to):
+    low = f"{date_from:%Y-%m}" if date_from else "0000-00"
+    high = f"{date_to:%Y-%m}" if date_to else "9999-99"
+    return low, high
+
+# Archives are written sorted by offset in row groups of ARCHIVE_ROW_GROUP
+# rows, so one record is found from the footer's per-group offset ranges and
+# read with its row group alone, not the whole month
+ARCHIVE_ROW_GROUP = 8192
+
+def _archive_rows(table):
+    rows = []
+    for row in table.to_pylist():
+        offset = row.pop("_offset")
+        rows.append((offset, {k: v for k, v in row.items() if v is not None}))
+    return rows
+
+# Archived partition: [(offset, record), ...] sorted by offset
+def _load_archive(path):
+    import pyarrow.parquet as pq
+    return _archive_rows(pq.read_table(path))
+
+# The log end an archive was written at, and the first offset of each of its
+# row groups. Cached per file version.
+@lru_cache(maxsize=256)
+def _archive_index(path, mtime_ns):
+    import pyarrow.parquet as pq
+    meta = pq.read_metadata(path)
+    column = meta.schema.names.index("_offset")
+    starts = [meta.row_group(i).column(column).statistics.min for i in range(meta.num_row_groups)]
+    return int(meta.metadata[b"log_end"]), starts
+
+# One row group as an Arrow table (columnar, so far smaller than its rows
+# as dicts); lookups cluster on recent months, so a few stay cached
+@lru_cache(maxsize=16)
+def _archive_group(path, mtime_ns, group):
+    import pyarrow.parquet as pq
+    return pq.ParquetFile(path).read_row_group(group)
+
+
+# One JSON-lines log per appointment month under a directory
+# (appointments/2025-10.jsonl, ...), so a date-range query only opens the
+# months it covers. A locator is (partition, offset).
+#
+# archive() moves past months to Parquet (<month>.parquet, zstd). The file
+# keeps every row's log offset and the log end, so locators stay valid; a
+# late booking for an archived month starts a new log whose offsets continue
+# from that end, and the next archive() folds it in.
+class PartitionedStore(AppointmentStore):
+    def __init__(self, root):
+        super().__init__(os.path.basename(os.path.normpath(root)))
+        self.root = root
+        self._lock = threading.RLock()
+        self._file_lock = FileLock(os.path.join(root, ".lock"))
+        self._ends = {}
+        os.makedirs(root, exist_ok=True)
+        with self._lock, self._file_lock:
+            for part in self.partitions():
+                self._recover(part)
+                if os.path.exists(self._log(part)):
+                    _repair_tail(self._log(part))
+
+    def _log(self, part):
+        return os.path.join(self.root, part + ".jsonl")
+
+    def _archive(self, part):
+        return os.path.join(self.root, part + ".parquet")
+
+    def partitions(self):
+        names = {os.path.splitext(n)[0] for n in os.listdir(self.root) if n.endswith((".jsonl", ".parquet"))}
+        return sorted(names)
+
+    # Offset the partition's log starts at (the archived end, or 0)
+    def _base(self, part):
+        path = self._archive(part)
+        try:
+            return _archive_index(path, os.stat(path).st_mtime_ns)[0]
+        except FileNotFoundError:
+            return 0
+
+    def _archived(self, part):
+        try:
+            return _load_archive(self._archive(part))
+        except FileNotFoundError:
+            return []
+
+    # Archive path, version and index of the row group holding offset
+    def _archive_group_of(self, part, offset):
+        path = self._archive(part)
+        mtime_ns = os.stat(path).st_mtime_ns
+        starts = _archive_index(path, mtime_ns)[1]
+        return path, mtime_ns, max(0, bisect.bisect_right(starts, offset) - 1), len(starts)
+
+    # Archived rows from offset start on, one row group at a time
+    def _iter_archived(self, part, start=0):
+        try:
+            path, mtime_ns, first, groups = self._archive_group_of(part, start)
+        except FileNotFoundError:
+            return
+        for group in range(first, groups):
+            rows = _archive_rows(_archive_group(path, mtime_ns, group))
+            yield from rows[bisect.bisect_left(rows, start, key=lambda e: e[0]):]
+
+    # Entries of one partition from offset start on, and its end
+    def _read_part(self, part, start=0):
+        base = self._base(part)
+        entries = []
+        if start < base:
+            rows = self._archived(part)
+            entries = rows[bisect.bisect_left(rows, start, key=lambda e: e[0]):]
+            start = base
+        log = self._log(part)
+        if os.path.exists(log) and os.path.getsize(log) > start - base:
+            more, end = _read_lines(log, start - base, base)
+            return entries + more, base + end
+        return entries, start
+
+    # Lazy version of _read_part for scans
+    def _iter_part(self, part, start=0):
+        base = self._base(part)
+        if start < base:
+            yield from self._iter_archived(part, start)
+            start = base
+        if os.path.exists(self._log(part)):
+            yield from _iter_lines(self._log(part), start - base, base)
+
+    def _sync(self):
+        for part in self.partitions():
+            entries, self._ends[part] = self._read_part(part, self._ends.get(part, 0))
+            self._notify([((part, offset), r) for offset, r in entries])
+
+    @_timed("load")
+    def load(self):
+        with self._lock:
+            self._sync()
+
+    @_timed("refresh")
+    def refresh(self):
+        with self._lock:
+            self._sync()
+
+    @contextmanager
+    def locked(self):
+        with self._lock, self._file_lock:
+            self._sync()
+            yield
+
+    @_timed("append")
+    def append_many(self, records, stamp=True):
+        records = [_stamp(r, stamp) for r in records]
+        if not records:
+            return []
+        lines = [(json.dumps(r, ensure_ascii=False) + "\n").encode("utf-8") for r in records]
+        parts = [partition_of(r) for r in records]
+        with self._lock, self._file_lock:
+            self._sync()
+            by_part = {}
+            for part, line in zip(parts, lines):
+                by_part.setdefault(part, []).append(line)
+            # One write + fsync per touched month
+            for part, chunk in by_part.items():
+                with open(self._log(part), "ab") as f:
+                    f.write(b"".join(chunk))
+                    f.flush()
+                    os.fsync(f.fileno())
+            locs = []
+            for part, line in zip(parts, lines):
+                end = self._ends.get(part) or self._base(part)
+                locs.append((part, end))
+                self._ends[part] = end + len(line)
+            self._notify(list(zip(locs, records)))
+        return locs
+
+    @_timed("scan")
+    def scan(self, start=None, date_from=None, date_to=None):
+        first, offset = tuple(start) if start else ("", 0)
+        low, high = _month_range(date_from, date_to)
+        ranged = date_from is not None or date_to is not None
+        for part in self.partitions():
+            if part < first:
+                continue
+            if ranged and (part == UNDATED or not low <= part <= high):
+                continue
+            for off, r in self._iter_part(part, offset if part == first else 0):
+                yield (part, off), r
+
+    @_timed("read")
+    def read_at(self, loc):
+        part, offset = loc
+        if offset < self._base(part):
+            import pyarrow.compute as pc
+            table = _archive_group(*self._archive_group_of(part, offset)[:3])
+            i = pc.index(table["_offset"], offset).as_py()
+            if i < 0:
+                raise KeyError(loc)
+            return _archive_rows(table.slice(i, 1))[0][1]
+        with open(self._log(part), "rb") as f:
+            f.seek(offset - self._base(part))
+            return json.loads(f.readline())
+
+    # Any offset into the archived rows works (a scan resumes at the next
+    # one); past them it must be a line start in the log
+    def valid_locator(self, loc):
+        if not isinstance(loc, (list, tuple)) or len(loc) != 2:
+            return False
+        part, offset = loc
+        if not isinstance(part, str) or type(offset) is not int or offset < 0 or part not in self.partitions():
+            return False
+        base = self._base(part)
+        if offset <= base:
+            return True
+        return os.path.exists(self._log(part)) and _line_start(self._log(part), offset - base)
+
+    # A crash between dropping a month's log and moving its new Parquet file
+    # into place leaves only the .tmp file: finish the move
+    def _recover(self, part):
+        tmp = self._archive(part) + ".tmp"
+        if os.path.exists(tmp):
+            if os.path.exists(self._log(part)):
+                os.remove(tmp)
+            else:
+                os.replace(tmp, self._archive(part))
+
+    # Moves every month before `before` (YYYY-MM) from JSON lines to
+    # Parquet; returns the months archived
+    def archive(self, before):
+        import pandas as pd
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+        done = []
+        with self._lock, self._file_lock:
+            self._sync()
+            for part in self.partitions():
+                if part == UNDATED or part >= before or not os.path.exists(self._log(part)):
+                    continue
+                entries, end = self._read_part(part, 0)
+                df = pd.DataFrame([r for _, r in entries])
+                df["_offset"] = [offset for offset, _ in entries]
+                table = pa.Table.from_pandas(df, preserve_index=False)
+                table = table.replace_schema_metadata({**(table.schema.metadata or {}), b"log_end": str(end).encode()})
+                tmp = self._archive(part) + ".tmp"
+                pq.write_table(table, tmp, compression="zstd", row_group_size=ARCHIVE_ROW_GROUP)
+                os.remove(self._log(part))
+                os.replace(tmp, self._archive(part))
+                self._ends[part] = end
+                done.append(part)
+        return done
+
+
+STORE_BACKENDS = {
+    "jsonl": JsonlLogStore,
+    "partitioned": PartitionedStore,
+}
+
+# spec is "<backend>:<location>", e.g. "partitioned:appointments" or
+# "jsonl:appointments.jsonl"
+def open_store(spec=DEFAULT_STORE):
+    backend, _, location = spec.partition(":")
+    if backend not in STORE_BACKENDS:
+        raise ValueError(f"Unknown appointment store backend: {backend}")
+    return STORE_BACKENDS[backend](location)
+
+
+# ---------- Migration ----------
+def _legacy_row(row):
+    record = {k: v for k, v in row.items() if k and v not in (None, "")}
+    if "partner_included" in record:
+        record["partner_included"] = str(record["partner_included"]).strip().lower() in ["true","yes","y","1"]
+    record.setdefault("type", "appointment")
+    return record
+
+def _is_callback(record):
+    return record.get("type", "appointment") != "appointment"
+
+# One-shot import of the old read-concat-rewrite CSV. The CSV is renamed
+# afterwards so the import never runs twice. Rows keep their created_at, or
+# none: the import time isn't when they were created. With a callback_store, callback
+# rows go there instead of into the appointment store.
+def migrate_csv(store, csv_path=LEGACY_CSV, callback_store=None):
+    if not os.path.exists(csv_path):
+        return 0
+    with FileLock(csv_path + ".lock"):
+        if not os.path.exists(csv_path):
+            return 0
+        with open(csv_path, newline="", encoding="utf-8") as f:
+            records = [_legacy_row(row) for row in csv.DictReader(f)]
+        if callback_store is None:
+            store.append_many(records, stamp=False)
+        else:
+            callback_store.append_many([r for r in records if _is_callback(r)], stamp=False)
+            store.append_many([r for r in records if not _is_callback(r)], stamp=False)
+        os.replace(csv_path, csv_path + ".migrated")
+    return len(records)
+
+# One-shot import of the single appointments.jsonl log into a partitioned
+# store (callbacks go to callback_store); the log is renamed afterwards
+def migrate_log(store, log_path=LEGACY_LOG, callback_store=None):
+    if not os.path.exists(log_path) or isinstance(store, JsonlLogStore):
+        return 0
+    with FileLock(log_path + ".migrate.lock"):
+        if not os.path.exists(log_path):
+            return 0
+        records = [r for _, r in _read_lines(log_path)[0]]
+        if callback_store is None:
+            store.append_many(records, stamp=False)
+        else:
+            callback_store.append_many([r for r in records if _is_callback(r)], stamp=False)
+            store.append_many([r for r in records if not _is_callback(r)], stamp=False)
+        os.replace(log_path, log_path + ".migrated")
+    return len(records)
+
+# Every one-shot migration, in order; cheap once they have run
+def migrate(store, callback_store):
+    n = migrate_log(store, callback_store=callback_store)
+    if isinstance(store, JsonlLogStore):
+        n += split_callbacks(store, callback_store)
+    return n + migrate_csv(store, callback_store=callback_store)
+
+# One-shot move of the callback rows older versions wrote into the
+# appointment log. Callbacks are copied first (skipping ones a crashed
+# earlier run already copied), then the log is rewritten without them; a
+# marker file keeps later startups from scanning the log again. Must run
+# before the appointment store is loaded.
+def split_callbacks(store, callback_store):
+    marker = store.path + ".split"
+    if os.path.exists(marker):
+        return 0
+    with FileLock(marker + ".lock"):
+        if os.path.exists(marker):
+            return 0
+        moved = [r for _, r in store.scan() if _is_callback(r)]
+        if moved:
+            copied = {json.dumps(r, sort_keys=True) for _, r in callback_store.scan()}
+            callback_store.append_many([r for r in moved if json.dumps(r, sort_keys=True) not in copied],
+                                      stamp=False)
+            store.rewrite(lambda r: not _is_callback(r))
+        open(marker, "w").close()
+    return len(moved)
+
+
+if __name__ == "__main__":
+    import sys
+    if sys.argv[1:2] == ["migrate"]:
+        store, callbacks = open_store(), open_store(CALLBACK_STORE)
+        n = migrate(store, callbacks)
+        print(f"Migrated {n} records")
+    elif sys.argv[1:2] == ["archive"]:
+        # Archive every month older than the last N (default 1: the current one)
+        keep = int(sys.argv[2]) if sys.argv[2:3] else 1
+        today = date.today()
+        month = today.year * 12 + today.month - keep
+        done = open_store().archive(f"{month // 12:04d}-{month % 12 + 1:02d}")
+        print(f"Archived {len(done)} partitions: {', '.join(done)}")
+    else:
+        print("usage: python appointment_store.py migrate | archive [months_to_keep]")
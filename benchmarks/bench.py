@@ -0,0 +1,268 @@
+# benchmarks/bench.py
+#
+# Load test for api_app and the booking flow, all in-process:
+#   python benchmarks/bench.py                         # 1k, 100k, 1M rows -> benchmarks/results.json
+#   python benchmarks/bench.py --rows 1000 --out b.json --compare benchmarks/baseline.json
+#
+# Each store size runs in its own process and scratch directory: the store is
+# seeded, api_app is imported against it and driven through httpx's ASGI
+# transport (no sockets). The booking flow runs end to end twice: through
+# /api/sessions, and through the Streamlit app (AppTest) with the fake LLM
+# client and LLM_FAKE_LATENCY seconds of upstream latency.
+import argparse
+import asyncio
+import json
+import os
+import platform
+import random
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import date, datetime, timedelta
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+DEFAULT_ROWS = [1000, 100000, 1000000]
+
+
+# ---------- Helpers ----------
+def summarize(samples, elapsed=None):
+    samples = sorted(samples)
+    n = len(samples)
+    pick = lambda q: samples[min(n - 1, int(q * n))] * 1000
+    out = {"n": n, "p50_ms": round(pick(0.50), 3), "p99_ms": round(pick(0.99), 3)}
+    if elapsed:
+        out["per_second"] = round(n / elapsed, 1)
+    return out
+
+def seed_records(n, rng):
+    from schedule import DEPARTMENTS
+    doctors = [(dept, doc, slots) for dept, docs in DEPARTMENTS.items() for doc, slots in docs.items()]
+    start = date.today() - timedelta(days=730)
+    for i in range(n):
+        dept, doctor, slots = rng.choice(doctors)
+        yield {
+            "first_name": f"First{i % 50000}", "last_name": f"Last{i % 997}", "sex": rng.choice(["Female", "Male"]),
+            "mobile": f"9{i:09d}", "dob": "01/01/1990", "email": f"patient{i}@example.com",
+            "partner_included": False, "department": dept, "doctor": doctor,
+            "date": (start + timedelta(days=rng.randrange(790))).isoformat(),
+            "time_slot": rng.choice(slots), "reason": "Consultation", "summary": "seeded",
+            "created_at": datetime(2024, 1, 1).isoformat(), "type": "appointment",
+        }
+
+def seed(n, rng, chunk=50000):
+    from appointment_store import open_store
+    store = open_store()
+    batch = []
+    for record in seed_records(n, rng):
+        batch.append(record)
+        if len(batch) == chunk:
+            store.append_many(batch)
+            batch = []
+    store.append_many(batch)
+
+def new_appointment(i):
+    return {
+        "first_name": "Bench", "last_name": f"User{i}", "sex": "Female", "mobile": f"8{i:09d}",
+        "dob": "01/01/1990", "email": f"bench{i}@example.com", "department": "Andrology",
+        "doctor": "Dr. Arun Menon", "date": "01/01/2099", "time_slot": f"slot-{i}", "reason": "bench",
+    }
+
+
+# ---------- API ----------
+async def timed(calls, concurrency=1):
+    samples = []
+    sem = asyncio.Semaphore(concurrency)
+    async def one(call):
+        async with sem:
+            t = time.perf_counter()
+            r = await call()
+            samples.append(time.perf_counter() - t)
+            assert r.status_code < 400, (r.status_code, r.text[:200])
+    started = time.perf_counter()
+    await asyncio.gather(*(one(c) for c in calls))
+    return summarize(samples, time.perf_counter() - started)
+
+def next_clinic_day(after=1):
+    day = date.today() + timedelta(days=after)
+    while day.weekday() == 6:
+        day += timedelta(days=1)
+    return day
+
+# Bookings made by the flow benchmarks land after the seeded dates, so there
+# are always free slots to pick
+FLOW_DAYS_AHEAD = 120
+
+async def booking_session(client, i, day):
+    r = await client.post("/api/sessions")
+    sid = r.json()["session_id"]
+    for value in [f"Flow{i}", "User", "Female", f"7{i:09d}", "01/01/1990", f"flow{i}@example.com", "P", "Q"]:
+        await client.post(f"/api/sessions/{sid}/input", json={"value": value})
+    prompt = (await client.post(f"/api/sessions/{sid}/input", json={"value": "Andrology"})).json()["prompt"]
+    doctor = prompt["options"][i % len(prompt["options"])]
+    await client.post(f"/api/sessions/{sid}/input", json={"value": doctor})
+    prompt = (await client.post(f"/api/sessions/{sid}/input", json={"value": day.strftime("%d/%m/%Y")})).json()["prompt"]
+    if not prompt.get("options"):
+        return await client.get(f"/api/sessions/{sid}")
+    await client.post(f"/api/sessions/{sid}/input", json={"value": prompt["options"][0]})
+    await client.post(f"/api/sessions/{sid}/input", json={"value": "bench"})
+    return await client.post(f"/api/sessions/{sid}/input", json={"action": "confirm"})
+
+async def bench_api(requests, concurrency):
+    import httpx
+    t = time.perf_counter()
+    import api_app
+    results = {"startup_s": round(time.perf_counter() - t, 3)}
+    rng = random.Random(1)
+    transport = httpx.ASGITransport(app=api_app.app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://bench", timeout=600) as client:
+        full = await client.get("/api/appointments")
+        etag = full.headers.get("etag")
+        results["get_full_listing"] = await timed([lambda: client.get("/api/appointments")] * max(3, requests // 20))
+        results["get_full_listing"]["body_bytes"] = len(full.content)
+        results["get_full_listing_304"] = await timed([lambda: client.get("/api/appointments", headers={"If-None-Match": etag})] * requests)
+        results["get_page_100"] = await timed([lambda: client.get("/api/appointments", params={"limit": 100})] * requests)
+        week = (date.today() - timedelta(days=rng.randrange(700)))
+        results["get_date_range_week"] = await timed(
+            [lambda: client.get("/api/appointments", params={"date_from": week.isoformat(), "date_to": (week + timedelta(days=6)).isoformat(), "limit": 1000})] * max(3, requests // 10))
+        results["get_lookup_mobile"] = await timed(
+            [lambda i=i: client.get("/api/appointments/lookup", params={"mobile": f"9{rng.randrange(1000):09d}"}) for i in range(requests)])
+        results["get_availability_day"] = await timed(
+            [lambda: client.get("/api/availability", params={"date": next_clinic_day().isoformat()})] * requests)
+        results["get_stats"] = await timed([lambda: client.get("/api/stats")] * requests)
+        results["post_appointment_serial"] = await timed(
+            [lambda i=i: client.post("/api/appointments", json=new_appointment(i)) for i in range(requests)])
+        results["post_appointment_concurrent"] = await timed(
+            [lambda i=i: client.post("/api/appointments", json=new_appointment(10**6 + i)) for i in range(requests)], concurrency)
+        results["post_appointment_concurrent"]["concurrency"] = concurrency
+        bulk = [new_appointment(2 * 10**6 + i) for i in range(5000)]
+        results["post_bulk_5000"] = await timed([lambda: client.post("/api/appointments/bulk", json=bulk)])
+        day = next_clinic_day(FLOW_DAYS_AHEAD)
+        results["booking_session_end_to_end"] = await timed(
+            [lambda i=i: booking_session(client, i, day + timedelta(days=i // 9)) for i in range(max(5, requests // 10))], concurrency)
+    api_app.committer.close()
+    return results
+
+
+# ---------- Streamlit flow ----------
+def bench_streamlit_flow(bookings, llm_latency):
+    os.environ["LLM_FAKE"] = "1"
+    os.environ["LLM_FAKE_LATENCY"] = str(llm_latency)
+    os.environ.setdefault("POC_API_URL", "http://127.0.0.1:9/api/appointments")
+    from streamlit.testing.v1 import AppTest
+    reruns, totals = [], []
+    day = next_clinic_day(FLOW_DAYS_AHEAD)
+    for i in range(bookings):
+        started = time.perf_counter()
+        at = AppTest.from_file(os.path.join(ROOT, "streamlit_app.py"), default_timeout=120).run()
+        def click(key=None, index=0):
+            t = time.perf_counter()
+            (at.button(key=key) if key else at.button[index]).click().run()
+            at.run()
+            reruns.append(time.perf_counter() - t)
+            assert not at.exception, at.exception
+        def step():
+            return at.session_state.booking["step"]
+        click(index=0)
+        for value in [f"Flow{i}", "User", "Female", f"6{i:09d}", "01/01/1990", "flow@example.com", "P", "Q"]:
+            at.text_input[0].input(value)
+            click(f"submit_{step()}")
+        click("submit_9")
+        click("submit_10")
+        at.text_input[0].input((day + timedelta(days=i // 3)).strftime("%d/%m/%Y"))
+        click("submit_11")
+        click("submit_12")
+        at.text_area[0].input("bench")
+        click("submit_13")
+        at.button[0].click().run()
+        while "pending_confirmation" in at.session_state:
+            time.sleep(0.05)
+            at.run()
+        totals.append(time.perf_counter() - started)
+    return {"rerun": summarize(reruns), "booking_total": summarize(totals), "llm_latency_s": llm_latency}
+
+
+# ---------- Driver ----------
+def worker(args):
+    os.chdir(tempfile.mkdtemp(prefix="bench-"))
+    sys.path.insert(0, ROOT)
+    os.environ["LLM_FAKE"] = "1"
+    rows = args.rows[0]
+    t = time.perf_counter()
+    seed(rows, random.Random(rows))
+    results = {"rows": rows, "seed_s": round(time.perf_counter() - t, 3)}
+    results.update(asyncio.run(bench_api(args.requests, args.concurrency)))
+    if args.flow_bookings:
+        results["streamlit_flow"] = bench_streamlit_flow(args.flow_bookings, args.llm_latency)
+    print(json.dumps(results))
+
+def compare(current, baseline, tolerance):
+    regressions = []
+    for rows, metrics in current["results"].items():
+        for name, now in metrics.items():
+            before = baseline.get("results", {}).get(rows, {}).get(name)
+            if not isinstance(now, dict) or not isinstance(before, dict):
+                continue
+            for key in ("p50_ms", "p99_ms"):
+                if key in now and before.get(key) and now[key] > before[key] * (1 + tolerance):
+                    regressions.append(f"{rows} rows {name} {key}: {before[key]} -> {now[key]}")
+    return regressions
+
+def git_commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "HEAD"], cwd=ROOT, capture_output=True, text=True).stdout.strip()
+    except OSError:
+        return None
+
+def main():
+    parser = argparse.ArgumentParser(description="api_app / booking flow benchmarks")
+    parser.add_argument("--rows", type=int, nargs="+", default=DEFAULT_ROWS)
+    parser.add_argument("--requests", type=int, default=200, help="requests per measured endpoint")
+    parser.add_argument("--concurrency", type=int, default=16)
+    parser.add_argument("--flow-bookings", type=int, default=3, help="Streamlit bookings per size (0 to skip)")
+    parser.add_argument("--llm-latency", type=float, default=0.5, help="fake LLM latency in seconds")
+    parser.add_argument("--out", default=os.path.join(ROOT, "benchmarks", "results.json"))
+    parser.add_argument("--compare", help="baseline JSON to check the results against")
+    parser.add_argument("--tolerance", type=float, default=0.25, help="allowed slowdown before a metric counts as a regression")
+    parser.add_argument("--worker", action="store_true", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+    if args.worker:
+        return worker(args)
+
+    report = {
+        "meta": {
+            "created_at": datetime.now().isoformat(timespec="seconds"),
+            "commit": git_commit(),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "cpus": os.cpu_count(),
+            "requests": args.requests,
+            "concurrency": args.concurrency,
+        },
+        "results": {},
+    }
+    for rows in args.rows:
+        cmd = [sys.executable, os.path.abspath(__file__), "--worker", "--rows", str(rows),
+               "--requests", str(args.requests), "--concurrency", str(args.concurrency),
+               "--flow-bookings", str(args.flow_bookings), "--llm-latency", str(args.llm_latency)]
+        print(f"Benchmarking {rows} rows...", file=sys.stderr)
+        out = subprocess.run(cmd, capture_output=True, text=True)
+        if out.returncode != 0:
+            print(out.stderr, file=sys.stderr)
+            sys.exit(out.returncode)
+        report["results"][str(rows)] = json.loads(out.stdout.strip().splitlines()[-1])
+
+    with open(args.out, "w") as f:
+        json.dump(report, f, indent=2)
+    print(json.dumps(report["results"], indent=2))
+
+    if args.compare:
+        with open(args.compare) as f:
+            regressions = compare(report, json.load(f), args.tolerance)
+        for line in regressions:
+            print("REGRESSION", line, file=sys.stderr)
+        sys.exit(1 if regressions else 0)
+
+
+if __name__ == "__main__":
+    main()
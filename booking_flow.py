@@ -0,0 +1,155 @@
+# booking_flow.py
+from datetime import datetime
+
+# ---------- Booking flow ----------
+# The appointment booking conversation as a pure state machine, shared by the
+# Streamlit app and the /api/sessions endpoints. A state is a plain JSON-able
+# dict ({"step", "form", "status"}); advance() takes a state and one input
+# and returns (new state, prompt for the new state, validation errors),
+# without touching any UI, store or network.
+#
+# Choice steps need the current options (departments, doctors, free slots).
+# The caller passes options(field, form) -> [choices], which is how the
+# machine sees availability without knowing where it comes from.
+
+ACTIVE, CONFIRMED, CANCELLED = "active", "confirmed", "cancelled"
+SUMMARY_STEP = 14
+
+STEPS = {
+    1: {"field": "first_name", "question": "Please enter your first name:", "kind": "text"},
+    2: {"field": "last_name", "question": "Please enter your last name:", "kind": "text"},
+    3: {"field": "sex", "question": "Sex assigned at birth (Female / Male / Prefer not to say):", "kind": "text"},
+    4: {"field": "mobile", "question": "Mobile number (for confirmation):", "kind": "text"},
+    5: {"field": "dob", "question": "Date of birth (DD/MM/YYYY):", "kind": "text"},
+    6: {"field": "email", "question": "Email ID:", "kind": "text"},
+    7: {"field": "partner_first", "question": "Partner's First Name:", "kind": "text", "missing": "Enter partner first name."},
+    8: {"field": "partner_last", "question": "Partner's Last Name:", "kind": "text", "missing": "Enter partner last name."},
+    9: {"field": "department", "question": "Select Department:", "kind": "choice"},
+    10: {"field": "doctor", "question": "Available Doctors", "kind": "choice"},
+    11: {"field": "date", "question": "Preferred Date (DD/MM/YYYY)", "kind": "date"},
+    12: {"field": "time_slot", "question": "Choose a time slot", "kind": "choice",
+         "empty": "No slots available on that date. Please choose another doctor or date."},
+    13: {"field": "reason", "question": "Reason for appointment (brief):", "kind": "textarea", "optional": True},
+    SUMMARY_STEP: {"field": None, "question": "Appointment Summary", "kind": "summary"},
+}
+
+SLOT_TAKEN_MESSAGE = "Sorry, that time slot was just booked by someone else. Please pick another slot."
+
+
+def start():
+    return {"step": 1, "form": {}, "status": ACTIVE}
+
+def parse_yes_no(val):
+    v = str(val).strip().lower()
+    if v in ["yes","y","true","1"]:
+        return True
+    return False
+
+def _no_options(field, form):
+    return []
+
+# What to show for a state: the question, and the options of a choice step
+def prompt(state, options=_no_options):
+    if state["status"] != ACTIVE:
+        return {"step": state["step"], "status": state["status"]}
+    spec = STEPS[state["step"]]
+    out = {"step": state["step"], "status": ACTIVE, "field": spec["field"], "kind": spec["kind"], "question": spec["question"]}
+    if spec["kind"] == "choice":
+        out["options"] = list(options(spec["field"], state["form"]))
+        if not out["options"] and spec.get("empty"):
+            out["message"] = spec["empty"]
+    elif spec["kind"] == "summary":
+        out["form"] = dict(state["form"])
+    return out
+
+def _back(state):
+    step = state["step"]
+    if step == 9:
+        return 8 if parse_yes_no(state["form"].get("partner_included", "no")) else 7
+    return max(1, step - 1)
+
+def _answer(state, value, options):
+    spec = STEPS[state["step"]]
+    value = str(value if value is not None else "").strip()
+    if spec["kind"] == "choice":
+        if value not in options(spec["field"], state["form"]):
+            return spec.get("empty") or "Please choose one of the options."
+    elif spec["kind"] == "date":
+        try:
+            datetime.strptime(value, "%d/%m/%Y")
+        except ValueError:
+            return "Invalid date format. Use DD/MM/YYYY"
+    elif not value and not spec.get("optional"):
+        return spec.get("missing", "Please enter a value.")
+    state["form"][spec["field"]] = value
+    state["step"] += 1
+    return None
+
+# One input: a plain string answers the current question; a dict is
+# {"action": "answer" | "back" | "goto" | "confirm" | "cancel", "value": ...}.
+# "goto" only moves back (e.g. step 1 to edit the details, step 10 to pick
+# another doctor). "confirm" on the summary only marks the state confirmed:
+# the caller commits booking_record(form) and calls slot_taken() if the
+# slot went in the meantime.
+def advance(state, input, options=_no_options):
+    if not isinstance(input, dict):
+        input = {"action": "answer", "value": input}
+    action = input.get("action", "answer")
+    value = input.get("value")
+    state = {"step": state["step"], "form": dict(state["form"]), "status": state["status"]}
+    errors = []
+
+    if state["status"] != ACTIVE:
+        errors.append(f"This booking is already {state['status']}.")
+    elif action == "cancel":
+        state["status"] = CANCELLED
+    elif action == "back":
+        state["step"] = _back(state)
+    elif action == "goto":
+        try:
+            target = int(value)
+        except (TypeError, ValueError):
+            target = 0
+        if 1 <= target <= state["step"]:
+            state["step"] = target
+        else:
+            errors.append("Can only go back to an earlier step.")
+    elif action == "confirm":
+        if state["step"] == SUMMARY_STEP:
+            state["status"] = CONFIRMED
+        else:
+            errors.append("Answer the remaining questions before confirming.")
+    elif action == "answer":
+        if state["step"] == SUMMARY_STEP:
+            errors.append("Confirm, edit or cancel the appointment.")
+        else:
+            error = _answer(state, value, options)
+            if error:
+                errors.append(error)
+    else:
+        errors.append(f"Unknown action: {action}")
+    return state, prompt(state, options), errors
+
+# The slot was taken between the summary and the commit: pick another one
+def slot_taken(state, options=_no_options):
+    state = {"step": 12, "form": dict(state["form"]), "status": ACTIVE}
+    return state, prompt(state, options), [SLOT_TAKEN_MESSAGE]
+
+def booking_record(form):
+    return {
+        "first_name": form.get("first_name",""),
+        "last_name": form.get("last_name",""),
+        "sex": form.get("sex",""),
+        "mobile": form.get("mobile",""),
+        "dob": form.get("dob",""),
+        "email": form.get("email",""),
+        "partner_included": parse_yes_no(form.get("partner_included","no")),
+        "partner_first": form.get("partner_first",""),
+        "partner_last": form.get("partner_last",""),
+        "department": form.get("department",""),
+        "doctor": form.get("doctor",""),
+        "date": form.get("date",""),
+        "time_slot": form.get("time_slot",""),
+        "reason": form.get("reason",""),
+        "summary": "Appointment booked via chatbot",
+    }
@@ -0,0 +1,216 @@
+# booking_pipeline.py
+import json
+import logging
+import random
+import sqlite3
+import threading
+import time
+from contextlib import closing
+from concurrent.futures import ThreadPoolExecutor
+
+log = logging.getLogger(__name__)
+
+# ---------- Outbox ----------
+# Durable queue of bookings that still have to reach the API. A booking is
+# written here before its first attempt and removed once the API has it;
+# failed attempts are retried with exponential backoff (with jitter).
+class Outbox:
+    def __init__(self, path="outbox.sqlite3", base_delay=5.0, max_delay=600.0):
+        self.path = path
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        with closing(self._connect()) as db, db:
+            db.execute("PRAGMA journal_mode=WAL")
+            db.execute("""CREATE TABLE IF NOT EXISTS outbox (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                payload TEXT NOT NULL,
+                attempts INTEGER NOT NULL DEFAULT 0,
+                next_attempt REAL NOT NULL,
+                last_error TEXT)""")
+            db.execute("CREATE INDEX IF NOT EXISTS outbox_due ON outbox(next_attempt)")
+
+    def _connect(self):
+        return sqlite3.connect(self.path, timeout=30)
+
+    # Returns the row id. The row isn't due for delay seconds, so the drainer
+    # leaves it to the attempt already under way.
+    def add(self, record, delay=0.0):
+        with closing(self._connect()) as db, db:
+            cur = db.execute("INSERT INTO outbox (payload, attempts, next_attempt) VALUES (?, 0, ?)",
+                             (json.dumps(record), time.time() + delay))
+            return cur.lastrowid
+
+    def due(self, limit=50):
+        with closing(self._connect()) as db:
+            rows = db.execute("SELECT id, payload, attempts FROM outbox WHERE next_attempt <= ? ORDER BY next_attempt LIMIT ?",
+                              (time.time(), limit)).fetchall()
+        return [(row_id, json.loads(payload), attempts) for row_id, payload, attempts in rows]
+
+    def ack(self, ids):
+        if ids:
+            with closing(self._connect()) as db, db:
+                db.executemany("DELETE FROM outbox WHERE id = ?", [(i,) for i in ids])
+
+    def retry(self, row_id, attempts, error):
+        with closing(self._connect()) as db, db:
+            db.execute("UPDATE outbox SET attempts = ?, next_attempt = ?, last_error = ? WHERE id = ?",
+                       (attempts + 1, time.time() + self._delay(attempts + 1), error, row_id))
+
+    def pending(self):
+        with closing(self._connect()) as db:
+            return db.execute("SELECT COUNT(*) FROM outbox").fetchone()[0]
+
+    def _delay(self, attempts):
+        return min(self.max_delay, self.base_delay * 2 ** (attempts - 1)) * random.uniform(0.5, 1.0)
+
+
+# ---------- Dispatch ----------
+# Side effects of one confirmed booking, running in the background: the
+# confirmation text (collected chunk by chunk so the UI can show it while it
+# streams) and the API sync.
+class Dispatch:
+    def __init__(self):
+        self.parts = []
+        self.text_done = threading.Event()
+        self.sync = None
+
+    @property
+    def text(self):
+        return "".join(self.parts)
+
+    @property
+    def done(self):
+        return self.text_done.is_set() and self.sync.done()
+
+
+SYNCED, QUEUED, REJECTED = "synced", "queued", "rejected"
+
+# Keep-alive connection pool for the API, shared by everything in the
+# process that talks to it: a burst of confirmations reuses open connections
+# instead of paying a TCP (and TLS) handshake per request. httpx is imported
+# here, off the app's startup path.
+def api_client(timeout=5, max_connections=20, keepalive_expiry=30):
+    import httpx
+    limits = httpx.Limits(max_connections=max_connections, max_keepalive_connections=max_connections,
+                          keepalive_expiry=keepalive_expiry)
+    return httpx.Client(timeout=timeout, limits=limits)
+
+# Client errors other than timeouts/rate limits will not succeed on retry
+def _permanent(status):
+    return 400 <= status < 500 and status not in (408, 425, 429)
+
+
+# Runs booking side effects off the UI thread once the local commit is
+# durable. The booking goes into the outbox before it is posted and leaves
+# it when the API answers, so a restart mid-sync can't lose it; one that
+# fails for a transient reason stays there for a background thread that
+# drains the outbox in batches through POST .../bulk.
+class BookingPipeline:
+    def __init__(self, api_url, outbox, workers=4, timeout=5, drain_interval=5.0, batch_size=50, client=None):
+        self.api_url = api_url
+        self.outbox = outbox
+        self.timeout = timeout
+        self.client = client or api_client(timeout)
+        self.drain_interval = drain_interval
+        self.batch_size = batch_size
+        self._pool = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="booking")
+        self._stop = threading.Event()
+        self._drainer = None
+
+    def start(self):
+        if self._drainer is None:
+            self._drainer = threading.Thread(target=self._drain_loop, name="outbox-drain", daemon=True)
+            self._drainer.start()
+
+    def stop(self):
+        self._stop.set()
+
+    def dispatch(self, record, confirmation_chunks=None):
+        d = Dispatch()
+        row_id = self.outbox.add(record, delay=2 * self.timeout)
+        d.sync = self._pool.submit(self._sync, record, row_id)
+        if confirmation_chunks is None:
+            d.text_done.set()
+        else:
+            self._pool.submit(self._collect, d, confirmation_chunks)
+        return d
+
+    def _collect(self, d, chunks):
+        try:
+            for chunk in chunks:
+                d.parts.append(chunk)
+        finally:
+            d.text_done.set()
+
+    def _post(self, record):
+        r = self.client.post(self.api_url, json=record, timeout=self.timeout)
+        return r.status_code, r.text[:200]
+
+    def _sync(self, record, row_id):
+        try:
+            status, body = self._post(record)
+        except Exception as e:
+            self.outbox.retry(row_id, 0, str(e))
+            return QUEUED
+        if status in (200, 201):
+            self.outbox.ack([row_id])
+            return SYNCED
+        if _permanent(status):
+            log.warning("API rejected booking (HTTP %s): %s", status, body)
+            self.outbox.ack([row_id])
+            return REJECTED
+        self.outbox.retry(row_id, 0, f"HTTP {status}: {body}")
+        return QUEUED
+
+    # Queued bookings go to the bulk endpoint in one request per batch
+    def drain(self):
+        batch = self.outbox.due(self.batch_size)
+        if not batch:
+            return 0
+        try:
+            r = self.client.post(self.api_url.rstrip("/") + "/bulk", json=[rec for _, rec, _ in batch], timeout=self.timeout)
+        except Exception as e:
+            for row_id, _, attempts in batch:
+                self.outbox.retry(row_id, attempts, str(e))
+            return len(batch)
+        if r.status_code == 404:
+            # API without the bulk endpoint
+            return self._drain_one_by_one(batch)
+        if r.status_code != 200:
+            for row_id, _, attempts in batch:
+                self.outbox.retry(row_id, attempts, f"HTTP {r.status_code}: {r.text[:200]}")
+            return len(batch)
+        # Every per-record outcome is final: created/duplicate made it,
+        # invalid/conflict never will
+        for (row_id, _, _), result in zip(batch, r.json()["results"]):
+            if result["status"] not in ("created", "duplicate"):
+                log.warning("API rejected queued booking %s: %s", row_id, result)
+        self.outbox.ack([row_id for row_id, _, _ in batch])
+        return len(batch)
+
+    def _drain_one_by_one(self, batch):
+        done = []
+        for row_id, record, attempts in batch:
+            try:
+                status, body = self._post(record)
+            except Exception as e:
+                self.outbox.retry(row_id, attempts, str(e))
+                continue
+            if status in (200, 201) or _permanent(status):
+                if status not in (200, 201):
+                    log.warning("API rejected queued booking %s (HTTP %s): %s", row_id, status, body)
+                done.append(row_id)
+            else:
+                self.outbox.retry(row_id, attempts, f"HTTP {status}: {body}")
+        self.outbox.ack(done)
+        return len(batch)
+
+    def _drain_loop(self):
+        while not self._stop.wait(self.drain_interval):
+            try:
+                # Keep going while full batches come back
+                while self.drain() == self.batch_size:
+                    pass
+            except Exception:
+                # Retried on the next tick; the rows stay in the outbox
+                log.exception("Outbox drain failed")
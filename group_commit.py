@@ -0,0 +1,145 @@
+# group_commit.py
+import asyncio
+import logging
+import queue
+import threading
+import time
+from concurrent.futures import Future, InvalidStateError
+import metrics
+
+log = logging.getLogger(__name__)
+
+COMMIT_SECONDS = metrics.histogram("group_commit_wait_seconds", "Time a caller waits for its record to be durable")
+BATCH_RECORDS = metrics.histogram("group_commit_batch_records", "Records per group-commit batch",
+                                  buckets=(1, 2, 4, 8, 16, 32, 64, 128, 256, 512, 1024))
+
+# A Future resolved twice must not take the writer thread down with it
+def _resolve(fut, result=None, error=None):
+    try:
+        if error is not None:
+            fut.set_exception(error)
+        else:
+            fut.set_result(result)
+    except InvalidStateError:
+        pass
+
+
+# ---------- Group commit ----------
+# Single writer thread in front of a store. Callers queue records and get a
+# Future back; the writer drains whatever is queued into one append_many()
+# call (one write + one fsync for the whole batch) and resolves each Future
+# only after the batch is durable. Under concurrency the batches grow, so
+# throughput scales with the number of waiting callers instead of paying
+# one fsync per record.
+#
+# checks are callables check(record, accepted) run under the store lock right
+# before the write, with the records already accepted into the same batch;
+# raising rejects that one record (its Future gets the exception).
+#
+# A Future cancelled before its batch starts (an async caller that went
+# away: asyncio.wrap_future cancels it) is dropped and its record is not
+# written; once the batch starts the Futures can no longer be cancelled.
+class GroupCommitter:
+    def __init__(self, store, checks=(), max_batch=512, max_wait=0.0):
+        self.store = store
+        self.checks = list(checks)
+        self.max_batch = max_batch
+        # Extra time to wait for stragglers once a batch has started;
+        # 0 means "take only what is already queued"
+        self.max_wait = max_wait
+        self._queue = queue.Queue()
+        self._thread = None
+        self._start_lock = threading.Lock()
+
+    def _ensure_started(self):
+        if self._thread is None:
+            with self._start_lock:
+                if self._thread is None:
+                    self._thread = threading.Thread(target=self._run, name="group-commit", daemon=True)
+                    self._thread.start()
+
+    # Records submitted together always land in the same batch
+    def submit_many(self, records):
+        unit = [(dict(r), Future()) for r in records]
+        if unit:
+            self._ensure_started()
+            self._queue.put(unit)
+        return [fut for _, fut in unit]
+
+    def submit(self, record):
+        return self.submit_many([record])[0]
+
+    def commit(self, record, timeout=None):
+        with metrics.timer(COMMIT_SECONDS, span="commit_wait"):
+            return self.submit(record).result(timeout)
+
+    # For async callers: waits for the batch without holding a thread
+    async def commit_async(self, record):
+        with metrics.timer(COMMIT_SECONDS, span="commit_wait"):
+            return await asyncio.wrap_future(self.submit(record))
+
+    def close(self, timeout=5):
+        if self._thread is not None:
+            self._queue.put(None)
+            self._thread.join(timeout)
+            self._thread = None
+
+    def _next_batch(self, first):
+        batch, size = [first], len(first)
+        deadline = time.monotonic() + self.max_wait
+        while size < self.max_batch:
+            remaining = deadline - time.monotonic()
+            try:
+                unit = self._queue.get(timeout=remaining) if remaining > 0 else self._queue.get_nowait()
+            except queue.Empty:
+                break
+            if unit is None:
+                # Put the stop marker back so the loop exits after this batch
+                self._queue.put(None)
+                break
+            batch.append(unit)
+            size += len(unit)
+        return [item for unit in batch for item in unit]
+
+    def _run(self):
+        while True:
+            first = self._queue.get()
+            if first is None:
+                return
+            # Nothing may end this thread but the stop marker: every later
+            # commit would wait forever
+            try:
+                self._commit(self._next_batch(first))
+            except Exception:
+                log.exception("Group commit batch failed")
+
+    def _commit(self, items):
+        items = [(r, fut) for r, fut in items if fut.set_running_or_notify_cancel()]
+        if not items:
+            return
+        BATCH_RECORDS.observe(len(items))
+        try:
+            with self.store.locked():
+                items = self._apply_checks(items)
+                locs = self.store.append_many([r for r, _ in items])
+        except Exception as e:
+            for _, fut in items:
+                _resolve(fut, error=e)
+            return
+        for (_, fut), loc in zip(items, locs):
+            _resolve(fut, loc)
+
+    def _apply_checks(self, items):
+        if not self.checks:
+            return items
+        accepted, records = [], []
+        for record, fut in items:
+            try:
+                for check in self.checks:
+                    check(record, records)
+            except Exception as e:
+                _resolve(fut, error=e)
+                continue
+            accepted.append((record, fut))
+            records.append(record)
+        return accepted
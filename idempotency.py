@@ -0,0 +1,128 @@
+# idempotency.py
+import hashlib
+import json
+import os
+import threading
+import time
+from collections import OrderedDict
+from datetime import datetime
+from appointment_store import normalize
+
+# ---------- Configuration ----------
+IDEMPOTENCY_TTL = int(os.getenv("IDEMPOTENCY_TTL", 24 * 3600))        # seconds a key is remembered
+IDEMPOTENCY_MAX_KEYS = int(os.getenv("IDEMPOTENCY_MAX_KEYS", 100000))
+KEY_FIELD = "idempotency_key"
+
+
+# A request whose key already committed. same_payload is False when the key
+# was reused for a different record.
+class DuplicateRequest(Exception):
+    def __init__(self, key, same_payload=True):
+        super().__init__(key)
+        self.key = key
+        self.same_payload = same_payload
+
+
+# Content hash of a record in its stored form, ignoring the fields the store
+# and this module add
+def fingerprint(record):
+    body = {k: v for k, v in normalize(record).items() if k not in ("created_at", KEY_FIELD)}
+    raw = json.dumps(body, sort_keys=True, ensure_ascii=False, separators=(",", ":"))
+    return "sha256:" + hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+# The record as clients see it. The key stays in the store (the index is
+# rebuilt from it) but is never handed out: it is a client's Idempotency-Key
+# or derived from a live booking session.
+def without_key(record):
+    if KEY_FIELD not in record:
+        return record
+    return {k: v for k, v in record.items() if k != KEY_FIELD}
+
+def _expires(record, ttl):
+    try:
+        return datetime.fromisoformat(record["created_at"]).timestamp() + ttl
+    except (KeyError, TypeError, ValueError):
+        return time.time() + ttl
+
+
+# ---------- Idempotency index ----------
+# key -> (expiry, fingerprint) for records committed with an idempotency key
+# (the client's Idempotency-Key header, or the content hash without one).
+# Entries arrive roughly in creation order, so the oldest sit at the front:
+# expiry and the size bound both just pop from there.
+class IdempotencyIndex:
+    def __init__(self, maxsize=IDEMPOTENCY_MAX_KEYS, ttl=IDEMPOTENCY_TTL):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._keys = OrderedDict()
+        self._lock = threading.Lock()
+        self._batch = None
+        self.replays = 0
+
+    # Store listener
+    def __call__(self, entries):
+        now = time.time()
+        with self._lock:
+            for _, record in entries:
+                key = record.get(KEY_FIELD)
+                if not key:
+                    continue
+                expires = _expires(record, self.ttl)
+                if expires <= now:
+                    continue
+                self._keys[key] = (expires, fingerprint(record))
+                self._keys.move_to_end(key)
+            self._evict(now)
+
+    def _evict(self, now):
+        while self._keys:
+            expires, _ = next(iter(self._keys.values()))
+            if expires > now and len(self._keys) <= self.maxsize:
+                break
+            self._keys.popitem(last=False)
+
+    # Fingerprint the key committed with, or None
+    def get(self, key):
+        with self._lock:
+            item = self._keys.get(key)
+            if item is None:
+                return None
+            if item[0] <= time.time():
+                del self._keys[key]
+                return None
+            return item[1]
+
+    # Raises DuplicateRequest if the record's key already committed
+    def lookup(self, record):
+        key = record.get(KEY_FIELD)
+        if not key:
+            return
+        seen = self.get(key)
+        if seen is not None:
+            self.replays += 1
+            raise DuplicateRequest(key, seen == fingerprint(record))
+
+    # Keys of records accepted earlier in the current batch (see OccupancyIndex)
+    def _batch_keys(self, accepted):
+        if self._batch is None or self._batch[0] is not accepted:
+            self._batch = (accepted, 0, {})
+        _, seen, keys = self._batch
+        for r in accepted[seen:]:
+            if r.get(KEY_FIELD):
+                keys.setdefault(r[KEY_FIELD], fingerprint(r))
+        self._batch = (accepted, len(accepted), keys)
+        return keys
+
+    # GroupCommitter check; goes before the occupancy check so a retried
+    # request is reported as a replay rather than as its own slot conflict
+    def check(self, record, accepted=()):
+        self.lookup(record)
+        key = record.get(KEY_FIELD)
+        if key:
+            seen = self._batch_keys(accepted).get(key)
+            if seen is not None:
+                self.replays += 1
+                raise DuplicateRequest(key, seen == fingerprint(record))
+
+    def __len__(self):
+        return len(self._keys)
@@ -0,0 +1,543 @@
+# llm_client.py
+import json
+import re
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import Future, ThreadPoolExecutor, TimeoutError as FutureTimeout
+import metrics
+
+# Per-menu (the page that asked) latency, errors and fallbacks
+LLM_SECONDS = metrics.histogram("llm_request_seconds", "Time to get an LLM completion, by menu", ("menu",),
+                                buckets=(0.01, 0.05, 0.1, 0.25, 0.5, 1.0, 2.0, 4.0, 8.0, 15.0, 30.0))
+LLM_ERRORS = metrics.counter("llm_errors_total", "Failed LLM calls by menu and error type", ("menu", "error"))
+LLM_FALLBACKS = metrics.counter("llm_fallbacks_total", "Fallback texts served instead of a completion, by menu", ("menu",))
+
+# ---------- Response cache ----------
+# LRU with a per-entry TTL for completion texts
+class TTLCache:
+    def __init__(self, maxsize=512, ttl=6 * 3600):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key):
+        with self._lock:
+            item = self._data.get(key)
+            if item is None or item[0] < time.monotonic():
+                if item is not None:
+                    del self._data[key]
+                self.misses += 1
+                return None
+            self._data.move_to_end(key)
+            self.hits += 1
+            return item[1]
+
+    def set(self, key, value):
+        with self._lock:
+            self._data[key] = (time.monotonic() + self.ttl, value)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def delete(self, key):
+        with self._lock:
+            self._data.pop(key, None)
+
+    def __len__(self):
+        return len(self._data)
+
+
+# Whitespace differences (e.g. indentation inside triple-quoted prompts)
+# don't change the completion, so they don't change the key either
+def cache_key(prompt, **params):
+    return (re.sub(r"\s+", " ", prompt).strip(), tuple(sorted(params.items())))
+
+def completion_text(resp):
+    return resp.get("choices", [{}])[0].get("message", {}).get("content", "")
+
+# EuriaiClient.stream_completion yields raw server-sent-event lines
+# ("data: {...}" / "data: [DONE]"); pull the text delta out of one
+def stream_chunk_text(line):
+    if isinstance(line, bytes):
+        line = line.decode("utf-8")
+    line = line.strip()
+    if line.startswith("data:"):
+        line = line[5:].strip()
+    if not line or line == "[DONE]":
+        return ""
+    try:
+        data = json.loads(line)
+    except ValueError:
+        return line
+    choice = (data.get("choices") or [{}])[0]
+    return (choice.get("delta") or {}).get("content") or (choice.get("message") or {}).get("content") or ""
+
+
+# ---------- Failure handling ----------
+class CircuitOpen(Exception):
+    pass
+
+class LLMTimeout(Exception):
+    pass
+
+class LLMBusy(Exception):
+    pass
+
+
+# closed: calls go through. After failure_threshold consecutive failures the
+# breaker opens and calls fail immediately; after reset_timeout one probe call
+# is let through (half_open) and its outcome closes or re-opens the breaker.
+class CircuitBreaker:
+    def __init__(self, failure_threshold=3, reset_timeout=30):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.failures = 0
+        self.opened_at = None
+        self.trips = 0
+        self._probing = False
+        self._lock = threading.Lock()
+
+    @property
+    def state(self):
+        if self.opened_at is None:
+            return "closed"
+        if time.monotonic() - self.opened_at >= self.reset_timeout:
+            return "half_open"
+        return "open"
+
+    def allow(self):
+        with self._lock:
+            state = self.state
+            if state == "closed":
+                return True
+            if state == "half_open" and not self._probing:
+                self._probing = True
+                return True
+            return False
+
+    def record_success(self):
+        with self._lock:
+            self.failures = 0
+            self.opened_at = None
+            self._probing = False
+
+    def record_failure(self):
+        with self._lock:
+            self.failures += 1
+            if self._probing or (self.opened_at is None and self.failures >= self.failure_threshold):
+                self.trips += 1
+                self.opened_at = time.monotonic()
+            self._probing = False
+
+    # A call that ended with no outcome (its caller went away) gives the
+    # probe back, so the next call can probe instead
+    def release(self):
+        with self._lock:
+            self._probing = False
+
+    def snapshot(self):
+        return {"state": self.state, "consecutive_failures": self.failures, "trips": self.trips}
+
+
+# Deadline that follows the upstream: a multiple of the smoothed latency of
+# successful calls, kept within [minimum, maximum]
+class AdaptiveTimeout:
+    def __init__(self, initial=8.0, minimum=2.0, maximum=15.0, factor=3.0, alpha=0.2):
+        self.minimum = minimum
+        self.maximum = maximum
+        self.factor = factor
+        self.alpha = alpha
+        self.latency = initial / factor
+
+    def observe(self, seconds):
+        self.latency += self.alpha * (seconds - self.latency)
+
+    def current(self):
+        return min(self.maximum, max(self.minimum, self.latency * self.factor))
+
+
+# ---------- Shared streams ----------
+# One upstream stream and everyone reading it: the producer appends chunks,
+# each reader keeps its own position. settle() is true for the first caller
+# only, so the upstream call's outcome reaches the breaker once.
+class StreamFlight:
+    def __init__(self, key, cache=True):
+        self.key = key
+        self.cache = cache
+        self.chunks = []
+        self.done = False
+        self.error = None
+        self.readers = 0
+        self.settled = False
+        self.stop = threading.Event()
+        self._cond = threading.Condition()
+
+    def put(self, chunk):
+        with self._cond:
+            self.chunks.append(chunk)
+            self._cond.notify_all()
+
+    def finish(self, error=None):
+        with self._cond:
+            self.done = True
+            self.error = error
+            self._cond.notify_all()
+
+    # Chunk i, None at the end, or the upstream error; raises LLMTimeout when
+    # nothing arrives within timeout seconds
+    def get(self, i, timeout):
+        with self._cond:
+            if not self._cond.wait_for(lambda: i < len(self.chunks) or self.done, timeout):
+                raise LLMTimeout(f"No LLM output for {timeout:.1f}s")
+            if i < len(self.chunks):
+                return self.chunks[i]
+            return self.error
+
+    def settle(self):
+        with self._cond:
+            first = not self.settled
+            self.settled = True
+            return first
+
+
+# ---------- Client wrapper ----------
+# Thin layer over EuriaiClient.generate_completion that returns the text and
+# serves repeated static prompts from the cache. Identical requests that are
+# already in flight are coalesced: the first caller makes the upstream call,
+# everyone else with the same key waits for and shares its result.
+#
+# Upstream calls run on a small worker pool so each one can be abandoned at
+# its deadline, and go through a circuit breaker. The deadline is also passed
+# to the client as its HTTP timeout, so an abandoned call frees its worker
+# soon after. When every worker is still taken the call fails fast (LLMBusy)
+# rather than queueing, so waiting for a worker never counts as an upstream
+# failure. With a fallback text, complete() never raises: timeouts, errors,
+# a busy pool and an open breaker all return the fallback (an open breaker
+# does so without touching the network).
+class LLMClient:
+    def __init__(self, client, cache=None, breaker=None, timeouts=None, max_workers=8):
+        self.client = client
+        self.cache = cache if cache is not None else TTLCache()
+        self.breaker = breaker or CircuitBreaker()
+        self.timeouts = timeouts or AdaptiveTimeout()
+        self.max_workers = max_workers
+        self._pool = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="llm")
+        self._busy = 0
+        self._inflight = {}
+        self._streams = {}
+        self._lock = threading.Lock()
+        self.upstream_calls = 0
+        self.deduplicated = 0
+        self.timeouts_hit = 0
+        self.fallbacks = 0
+
+    def complete(self, prompt, temperature=0.7, max_tokens=500, cache=True, timeout=None, fallback=None, menu="other"):
+        with metrics.timer(LLM_SECONDS, span="llm", menu=menu):
+            try:
+                return self._complete(prompt, temperature, max_tokens, cache, timeout)
+            except Exception as e:
+                LLM_ERRORS.inc(menu=menu, error=type(e).__name__)
+                if fallback is None:
+                    raise
+                self._fell_back(menu)
+                return fallback
+
+    def _fell_back(self, menu):
+        with self._lock:
+            self.fallbacks += 1
+        LLM_FALLBACKS.inc(menu=menu)
+
+    # Takes a worker for an upstream call and the breaker's permission; the
+    # worker is given back by _run when the job ends
+    def _acquire(self):
+        with self._lock:
+            if self._busy >= self.max_workers:
+                raise LLMBusy("All LLM workers are busy")
+            self._busy += 1
+        if not self.breaker.allow():
+            self._release()
+            raise CircuitOpen("LLM circuit breaker is open")
+        with self._lock:
+            self.upstream_calls += 1
+
+    def _release(self):
+        with self._lock:
+            self._busy -= 1
+
+    def _run(self, fn, *args, **kwargs):
+        try:
+            return fn(*args, **kwargs)
+        finally:
+            self._release()
+
+    def _call(self, prompt, temperature, max_tokens, timeout):
+        self._acquire()
+        deadline = timeout or self.timeouts.current()
+        started = time.monotonic()
+        call = self._pool.submit(self._run, self.client.generate_completion, prompt=prompt,
+                                 temperature=temperature, max_tokens=max_tokens, timeout=deadline)
+        try:
+            resp = call.result(timeout=deadline)
+        except FutureTimeout:
+            self.timeouts_hit += 1
+            self.breaker.record_failure()
+            raise LLMTimeout(f"LLM call exceeded {deadline:.1f}s")
+        except Exception:
+            self.breaker.record_failure()
+            raise
+        self.breaker.record_success()
+        self.timeouts.observe(time.monotonic() - started)
+        return completion_text(resp)
+
+    def _complete(self, prompt, temperature, max_tokens, cache, timeout):
+        key = cache_key(prompt, temperature=temperature, max_tokens=max_tokens)
+        if cache:
+            text = self.cache.get(key)
+            if text is not None:
+                return text
+
+        with self._lock:
+            pending = self._inflight.get(key)
+            if pending is None:
+                pending = self._inflight[key] = Future()
+                leader = True
+            else:
+                self.deduplicated += 1
+                leader = False
+        if not leader:
+            return pending.result()
+
+        try:
+            text = self._call(prompt, temperature, max_tokens, timeout)
+            # Cache before leaving the in-flight table so late arrivals hit it
+            if cache and text:
+                self.cache.set(key, text)
+            pending.set_result(text)
+            return text
+        except Exception as e:
+            pending.set_exception(e)
+            raise
+        finally:
+            with self._lock:
+                del self._inflight[key]
+
+    # Yields the completion text chunk by chunk as the upstream produces it.
+    # The deadline applies to the first chunk and to every gap between
+    # chunks. A failure before anything was yielded turns into the fallback;
+    # a failure mid-stream just ends the stream. Identical streams in flight
+    # are coalesced like complete(): followers replay the chunks the leader's
+    # upstream call already produced, then follow along. The upstream call is
+    # stopped once every reader has gone, and its outcome is given to the
+    # breaker once: a stream all its readers dropped early (a Streamlit rerun
+    # interrupting st.write_stream) counts as a success once a chunk arrived.
+    # Latency counts only the time spent waiting for chunks, not the caller's
+    # rendering.
+    def stream(self, prompt, temperature=0.7, max_tokens=500, cache=True, timeout=None, fallback=None, menu="other"):
+        chunks = self._stream(prompt, temperature, max_tokens, cache, timeout, fallback, menu)
+        return metrics.timed_iter(LLM_SECONDS, chunks, span="llm", menu=menu)
+
+    def _stream(self, prompt, temperature, max_tokens, cache, timeout, fallback, menu):
+        key = cache_key(prompt, temperature=temperature, max_tokens=max_tokens)
+        if cache:
+            text = self.cache.get(key)
+            if text is not None:
+                yield text
+                return
+
+        with self._lock:
+            flight = self._streams.get(key)
+            leader = flight is None
+            if leader:
+                flight = self._streams[key] = StreamFlight(key, cache)
+            else:
+                self.deduplicated += 1
+            flight.readers += 1
+        try:
+            deadline = timeout or self.timeouts.current()
+            if leader:
+                try:
+                    self._acquire()
+                    self._pool.submit(self._run, self._produce, flight, prompt, temperature, max_tokens, deadline)
+                except (LLMBusy, CircuitOpen) as e:
+                    # No upstream call was made: nothing for the breaker
+                    flight.settle()
+                    self._land(flight, e)
+            i = 0
+            while True:
+                try:
+                    item = flight.get(i, deadline)
+                except LLMTimeout as e:
+                    self.timeouts_hit += 1
+                    if flight.settle():
+                        self.breaker.record_failure()
+                    item = e
+                if item is None:
+                    return
+                if isinstance(item, Exception):
+                    LLM_ERRORS.inc(menu=menu, error=type(item).__name__)
+                    if i:
+                        return
+                    if fallback is None:
+                        raise item
+                    self._fell_back(menu)
+                    yield fallback
+                    return
+                i += 1
+                yield item
+        finally:
+            self._leave(flight)
+
+    def _leave(self, flight):
+        with self._lock:
+            flight.readers -= 1
+            last = flight.readers == 0
+            if last and self._streams.get(flight.key) is flight:
+                del self._streams[flight.key]
+        if last:
+            flight.stop.set()
+            if flight.settle():
+                if flight.chunks:
+                    self.breaker.record_success()
+                else:
+                    self.breaker.release()
+
+    # Ends a flight whose upstream call is over: the breaker outcome, the
+    # cache (complete answers only, and before leaving the in-flight table so
+    # late arrivals hit it), then the readers are woken
+    def _land(self, flight, error=None):
+        if flight.settle():
+            if error is None:
+                self.breaker.record_success()
+            else:
+                self.breaker.record_failure()
+        if error is None and flight.cache and flight.chunks:
+            self.cache.set(flight.key, "".join(flight.chunks))
+        with self._lock:
+            if self._streams.get(flight.key) is flight:
+                del self._streams[flight.key]
+        flight.finish(error)
+
+    def _produce(self, flight, prompt, temperature, max_tokens, timeout):
+        try:
+            streamer = getattr(self.client, "stream_completion", None)
+            if streamer is None:
+                resp = self.client.generate_completion(prompt=prompt, temperature=temperature, max_tokens=max_tokens,
+                                                       timeout=timeout)
+                flight.put(completion_text(resp))
+            else:
+                for line in streamer(prompt=prompt, temperature=temperature, max_tokens=max_tokens, timeout=timeout):
+                    if flight.stop.is_set():
+                        return
+                    text = stream_chunk_text(line)
+                    if text:
+                        flight.put(text)
+        except Exception as e:
+            self._land(flight, e)
+        else:
+            self._land(flight)
+
+    def stats(self):
+        return {
+            "upstream_calls": self.upstream_calls,
+            "deduplicated": self.deduplicated,
+            "in_flight": len(self._inflight) + len(self._streams),
+            "busy_workers": self._busy,
+            "cache_hits": self.cache.hits,
+            "cache_misses": self.cache.misses,
+            "cache_size": len(self.cache),
+            "timeouts": self.timeouts_hit,
+            "fallbacks": self.fallbacks,
+            "deadline_seconds": round(self.timeouts.current(), 2),
+            "breaker": self.breaker.snapshot(),
+        }
+
+    # Pre-generate [(prompt, params), ...] in the background so the first
+    # visitor doesn't pay for them
+    def warm_up(self, items):
+        def run():
+            for prompt, params in items:
+                try:
+                    self.complete(prompt, **params, menu="warm_up")
+                except Exception:
+                    pass
+        thread = threading.Thread(target=run, name="llm-warm-up", daemon=True)
+        thread.start()
+        return thread
+
+
+# ---------- Euri API client ----------
+# The two calls LLMClient makes of euriai.EuriaiClient, over one keep-alive
+# httpx session and with a timeout on every request. EuriaiClient posts
+# without a timeout, so a hung upstream held its worker thread indefinitely.
+# The timeout bounds connecting and each read, i.e. the wait for the first
+# chunk and every gap between chunks, like the deadline in LLMClient.stream().
+EURI_ENDPOINT = "https://api.euron.one/api/v1/euri/chat/completions"
+
+class EuriClient:
+    def __init__(self, api_key, model="gpt-4.1-nano", endpoint=EURI_ENDPOINT, max_connections=8, timeout=15.0):
+        import httpx
+        self.model = model
+        self.endpoint = endpoint
+        self.timeout = timeout
+        limits = httpx.Limits(max_connections=max_connections, max_keepalive_connections=max_connections)
+        self._http = httpx.Client(headers={"Authorization": f"Bearer {api_key}"}, limits=limits)
+
+    def _payload(self, prompt, temperature, max_tokens, **extra):
+        return {"model": self.model, "messages": [{"role": "user", "content": prompt}],
+                "temperature": temperature, "max_tokens": max_tokens, **extra}
+
+    def generate_completion(self, prompt, temperature=0.7, max_tokens=500, timeout=None):
+        resp = self._http.post(self.endpoint, json=self._payload(prompt, temperature, max_tokens),
+                               timeout=timeout or self.timeout)
+        resp.raise_for_status()
+        return resp.json()
+
+    def stream_completion(self, prompt, temperature=0.7, max_tokens=500, timeout=None):
+        payload = self._payload(prompt, temperature, max_tokens, stream=True)
+        with self._http.stream("POST", self.endpoint, json=payload, timeout=timeout or self.timeout) as resp:
+            resp.raise_for_status()
+            for line in resp.iter_lines():
+                if line:
+                    yield line
+
+
+# ---------- Local fake ----------
+# Stand-in for EuriaiClient with canned output and configurable latency, for
+# running the app, demos and load tests without the Euri API (LLM_FAKE=1).
+class FakeEuriaiClient:
+    def __init__(self, text="This is a canned reply from the local fake LLM client. Warm regards, Avenir Fertility Clinic",
+                 latency=0.0, chunk_delay=0.0, chunk_size=12, fail=False):
+        self.text = text
+        self.latency = latency
+        self.chunk_delay = chunk_delay
+        self.chunk_size = chunk_size
+        self.fail = fail
+        self.calls = 0
+
+    # Honours the timeout like the real client: a reply slower than it is cut
+    # off there
+    def _start(self, timeout=None):
+        self.calls += 1
+        if timeout is not None and self.latency > timeout:
+            time.sleep(timeout)
+            raise TimeoutError("fake LLM timed out")
+        time.sleep(self.latency)
+        if self.fail:
+            raise ConnectionError("fake LLM failure")
+
+    def generate_completion(self, prompt, temperature=0.7, max_tokens=500, timeout=None, **kwargs):
+        self._start(timeout)
+        return {"choices": [{"message": {"role": "assistant", "content": self.text}}]}
+
+    def stream_completion(self, prompt, temperature=0.7, max_tokens=500, timeout=None, **kwargs):
+        self._start(timeout)
+        for i in range(0, len(self.text), self.chunk_size):
+            if i:
+                time.sleep(self.chunk_delay)
+            delta = {"choices": [{"delta": {"content": self.text[i:i + self.chunk_size]}}]}
+            yield "data: " + json.dumps(delta)
+        yield "data: [DONE]"
@@ -0,0 +1,58 @@
+# lookup_index.py
+import re
+import threading
+
+# Mobile numbers are compared on their last 10 digits, so "+91 98765 43210"
+# and "9876543210" are the same patient
+def normalize_mobile(value):
+    return re.sub(r"\D", "", str(value or ""))[-10:]
+
+def normalize_email(value):
+    return str(value or "").strip().lower()
+
+def normalize_name(first, last):
+    return (" ".join(str(first or "").split()).lower(), " ".join(str(last or "").split()).lower())
+
+
+# ---------- Patient lookup ----------
+# Hash indexes from normalized mobile, email and (first, last) name to the
+# store locators of the matching appointments. Kept current as a store
+# listener; a lookup is a dict hit plus one read_at() per match.
+class PatientIndex:
+    def __init__(self):
+        self._by_mobile = {}
+        self._by_email = {}
+        self._by_name = {}
+        self._lock = threading.Lock()
+
+    # Store listener
+    def __call__(self, entries):
+        with self._lock:
+            for loc, record in entries:
+                if record.get("type", "appointment") != "appointment":
+                    continue
+                mobile = normalize_mobile(record.get("mobile"))
+                if mobile:
+                    self._by_mobile.setdefault(mobile, []).append(loc)
+                email = normalize_email(record.get("email"))
+                if email:
+                    self._by_email.setdefault(email, []).append(loc)
+                name = normalize_name(record.get("first_name"), record.get("last_name"))
+                if any(name):
+                    self._by_name.setdefault(name, []).append(loc)
+
+    # Locators matching every given criterion, in store order
+    def find(self, mobile=None, email=None, first_name=None, last_name=None):
+        hits = []
+        with self._lock:
+            if mobile is not None:
+                hits.append(self._by_mobile.get(normalize_mobile(mobile), []))
+            if email is not None:
+                hits.append(self._by_email.get(normalize_email(email), []))
+            if first_name is not None or last_name is not None:
+                hits.append(self._by_name.get(normalize_name(first_name, last_name), []))
+            hits = [list(h) for h in hits]
+        if not hits:
+            return []
+        rest = [set(h) for h in hits[1:]]
+        return [loc for loc in hits[0] if all(loc in s for s in rest)]
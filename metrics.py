@@ -0,0 +1,272 @@
+# metrics.py
+import bisect
+import contextvars
+import os
+import threading
+import time
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# ---------- Configuration ----------
+# With PROFILE_REQUESTS=1 a request sent with "X-Profile: 1" gets a
+# Server-Timing header breaking its time down into store, commit and LLM spans
+PROFILE_REQUESTS = os.getenv("PROFILE_REQUESTS", "").lower() in ["1","true","yes"]
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+
+# ---------- Metric types ----------
+# In-process counters and histograms rendered in the Prometheus text format.
+# Labels are passed as keywords; each metric keeps one series per distinct
+# combination of label values.
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace("\"", "\\\"").replace("\n", "\\n")
+
+def _labels(names, values, extra=()):
+    pairs = [f'{n}="{_escape(v)}"' for n, v in list(zip(names, values)) + list(extra)]
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+def _number(value):
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Counter:
+    kind = "counter"
+
+    def __init__(self, name, help, labels=()):
+        self.name = name
+        self.help = help
+        self.label_names = tuple(labels)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, amount=1, **labels):
+        key = tuple(labels.get(n, "") for n in self.label_names)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def value(self, **labels):
+        return self._values.get(tuple(labels.get(n, "") for n in self.label_names), 0)
+
+    def samples(self):
+        with self._lock:
+            items = list(self._values.items())
+        for key, value in items:
+            yield self.name, _labels(self.label_names, key), value
+
+
+# Buckets are counted individually on observe() and made cumulative when
+# rendered, so recording a value is one bisect and three additions
+class Histogram:
+    kind = "histogram"
+
+    def __init__(self, name, help, labels=(), buckets=LATENCY_BUCKETS):
+        self.name = name
+        self.help = help
+        self.label_names = tuple(labels)
+        self.buckets = tuple(sorted(buckets))
+        self._series = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value, **labels):
+        key = tuple(labels.get(n, "") for n in self.label_names)
+        i = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(key)
+            if series is None:
+                series = self._series[key] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            series[0][i] += 1
+            series[1] += value
+            series[2] += 1
+
+    def count(self, **labels):
+        series = self._series.get(tuple(labels.get(n, "") for n in self.label_names))
+        return series[2] if series else 0
+
+    def samples(self):
+        with self._lock:
+            items = [(key, list(counts), total, n) for key, (counts, total, n) in self._series.items()]
+        for key, counts, total, n in items:
+            running = 0
+            for bound, count in zip(self.buckets + (float("inf"),), counts):
+                running += count
+                le = "+Inf" if bound == float("inf") else _number(float(bound))
+                yield self.name + "_bucket", _labels(self.label_names, key, [("le", le)]), running
+            yield self.name + "_sum", _labels(self.label_names, key), total
+            yield self.name + "_count", _labels(self.label_names, key), n
+
+
+# Read at scrape time from fn(), which returns a number
+class Gauge:
+    kind = "gauge"
+
+    def __init__(self, name, help, fn):
+        self.name = name
+        self.help = help
+        self.fn = fn
+
+    def samples(self):
+        try:
+            yield self.name, "", self.fn()
+        except Exception:
+            return
+
+
+# ---------- Registry ----------
+# Metrics are created get-or-create by name, so a module that is executed
+# again (every Streamlit rerun) keeps adding to the same series
+class Registry:
+    def __init__(self):
+        self._metrics = {}
+        self._lock = threading.Lock()
+
+    def _get(self, cls, name, *args, **kwargs):
+        with self._lock:
+            metric = self._metrics.get(name)
+            if metric is None:
+                metric = self._metrics[name] = cls(name, *args, **kwargs)
+            return metric
+
+    def render(self):
+        lines = []
+        for metric in list(self._metrics.values()):
+            lines.append(f"# HELP {metric.name} {metric.help}")
+            lines.append(f"# TYPE {metric.name} {metric.kind}")
+            for name, labels, value in metric.samples():
+                lines.append(f"{name}{labels} {_number(value)}")
+        return "\n".join(lines) + "\n"
+
+REGISTRY = Registry()
+
+def counter(name, help, labels=()):
+    return REGISTRY._get(Counter, name, help, labels)
+
+def histogram(name, help, labels=(), buckets=LATENCY_BUCKETS):
+    return REGISTRY._get(Histogram, name, help, labels, buckets)
+
+def gauge(name, help, fn):
+    metric = REGISTRY._get(Gauge, name, help, fn)
+    metric.fn = fn
+    return metric
+
+def render():
+    return REGISTRY.render()
+
+
+# ---------- Timers and request profiles ----------
+# Spans of the request being profiled (None when it isn't). Starlette runs
+# sync endpoints in a worker thread with a copy of the context, so timers
+# inside them still find the request's span table.
+_spans = contextvars.ContextVar("metrics_spans", default=None)
+
+def _record(metric, elapsed, span, labels):
+    metric.observe(elapsed, **labels)
+    spans = _spans.get()
+    if spans is not None:
+        name = span or metric.name
+        total, calls = spans.get(name, (0.0, 0))
+        spans[name] = (total + elapsed, calls + 1)
+
+@contextmanager
+def timer(metric, span=None, **labels):
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        elapsed = time.perf_counter() - started
+        _record(metric, elapsed, span, labels)
+
+# Times only the work inside the iterator (not the consumer's), observed once
+# when the iteration ends. Closing this closes the wrapped iterator too, so a
+# generator underneath runs its cleanup right away.
+def timed_iter(metric, iterable, span=None, **labels):
+    elapsed = 0.0
+    iterator = iter(iterable)
+    try:
+        while True:
+            started = time.perf_counter()
+            try:
+                item = next(iterator)
+            except StopIteration:
+                return
+            finally:
+                elapsed += time.perf_counter() - started
+            yield item
+    finally:
+        close = getattr(iterator, "close", None)
+        if close is not None:
+            close()
+        _record(metric, elapsed, span, labels)
+
+def server_timing(spans, total):
+    parts = [f'{name};dur={seconds * 1000:.2f};desc="{calls}x"' for name, (seconds, calls) in sorted(spans.items())]
+    parts.append(f"total;dur={total * 1000:.2f}")
+    return ", ".join(parts)
+
+
+# ---------- ASGI middleware ----------
+# Request count and latency per route template (not per raw path, so ids in
+# URLs don't create new series), timed until the last body chunk is sent.
+# on_profile(method, route, spans, seconds) is called for profiled requests.
+HTTP_SECONDS = histogram("http_request_duration_seconds", "HTTP request latency by route", ("method", "route"))
+HTTP_REQUESTS = counter("http_requests_total", "HTTP requests by route and status", ("method", "route", "status"))
+
+class MetricsMiddleware:
+    def __init__(self, app, profiling=PROFILE_REQUESTS, on_profile=None):
+        self.app = app
+        self.profiling = profiling
+        self.on_profile = on_profile
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+        started = time.perf_counter()
+        status = 500
+        spans = None
+        if self.profiling and (b"x-profile", b"1") in scope.get("headers", []):
+            spans = {}
+        token = _spans.set(spans)
+
+        async def send_timed(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+                if spans is not None:
+                    timing = server_timing(spans, time.perf_counter() - started).encode("latin-1")
+                    message = dict(message, headers=list(message.get("headers", [])) + [(b"server-timing", timing)])
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_timed)
+        finally:
+            _spans.reset(token)
+            elapsed = time.perf_counter() - started
+            route = scope.get("route")
+            route = getattr(route, "path", None) or "unmatched"
+            HTTP_SECONDS.observe(elapsed, method=scope["method"], route=route)
+            HTTP_REQUESTS.inc(method=scope["method"], route=route, status=status)
+            if spans is not None and self.on_profile is not None:
+                self.on_profile(scope["method"], route, spans, elapsed)
+
+
+# ---------- Standalone endpoint ----------
+# /metrics for processes without a web framework of their own (Streamlit)
+class _Handler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path.split("?")[0] != "/metrics":
+            self.send_error(404)
+            return
+        body = render().encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", CONTENT_TYPE)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+def serve(port, addr=""):
+    server = ThreadingHTTPServer((addr, port), _Handler)
+    threading.Thread(target=server.serve_forever, name="metrics", daemon=True).start()
+    return server
@@ -0,0 +1,87 @@
+# occupancy.py
+import re
+import threading
+from appointment_store import parse_date
+
+class SlotTaken(Exception):
+    pass
+
+# The same patient booking the same slot again (a retry or a rerun)
+class AlreadyBooked(Exception):
+    pass
+
+
+def slot_key(record):
+    if record.get("type", "appointment") != "appointment":
+        return None
+    day = parse_date(record.get("date"))
+    doctor = str(record.get("doctor") or "").strip()
+    slot = str(record.get("time_slot") or "").strip().upper()
+    if not (day and doctor and slot):
+        return None
+    return (doctor, day.isoformat(), slot)
+
+def _holder(record):
+    mobile = re.sub(r"\D", "", str(record.get("mobile") or ""))
+    return (mobile,
+            str(record.get("first_name") or "").strip().lower(),
+            str(record.get("last_name") or "").strip().lower())
+
+
+# ---------- Occupancy index ----------
+# (doctor, date, slot) -> who holds it, plus (doctor, date) -> taken slots.
+# Filled once from the store at startup and then kept current as a store
+# listener, so every lookup is a dict hit instead of a file scan.
+class OccupancyIndex:
+    def __init__(self):
+        self._holders = {}
+        self._by_day = {}
+        self._lock = threading.Lock()
+        self._batch = None
+
+    # Store listener
+    def __call__(self, entries):
+        with self._lock:
+            for _, record in entries:
+                key = slot_key(record)
+                if key is None:
+                    continue
+                self._holders.setdefault(key, _holder(record))
+                self._by_day.setdefault(key[:2], set()).add(key[2])
+
+    def taken_slots(self, doctor, date):
+        day = parse_date(date)
+        if day is None:
+            return set()
+        return set(self._by_day.get((str(doctor).strip(), day.isoformat()), ()))
+
+    def is_taken(self, doctor, date, slot):
+        return str(slot).strip().upper() in self.taken_slots(doctor, date)
+
+    # Slots held by records accepted earlier in the current batch. The
+    # committer only ever appends to `accepted`, so just index the new tail.
+    def _batch_holders(self, accepted):
+        if self._batch is None or self._batch[0] is not accepted:
+            self._batch = (accepted, 0, {})
+        _, seen, holders = self._batch
+        for r in accepted[seen:]:
+            key = slot_key(r)
+            if key is not None:
+                holders.setdefault(key, _holder(r))
+        self._batch = (accepted, len(accepted), holders)
+        return holders
+
+    # GroupCommitter check: reject a slot that is already held, either in the
+    # index or by a record accepted earlier in the same batch
+    def check(self, record, accepted=()):
+        key = slot_key(record)
+        if key is None:
+            return
+        holder = self._holders.get(key)
+        if holder is None:
+            holder = self._batch_holders(accepted).get(key)
+        if holder is None:
+            return
+        if holder == _holder(record):
+            raise AlreadyBooked(f"{key[0]} on {record.get('date')} at {record.get('time_slot')} is already booked for this patient")
+        raise SlotTaken(f"{key[0]} is already booked on {record.get('date')} at {record.get('time_slot')}")
@@ -0,0 +1,277 @@
+# reminders.py
+import heapq
+import json
+import logging
+import os
+import sqlite3
+import sys
+import threading
+import time
+from contextlib import closing
+from datetime import datetime, time as Time
+from functools import lru_cache
+from appointment_store import open_store, parse_date
+import metrics
+
+log = logging.getLogger(__name__)
+
+# ---------- Configuration ----------
+REMINDER_LEAD = float(os.getenv("REMINDER_LEAD_HOURS", 24)) * 3600   # seconds before the appointment
+REMINDER_BATCH = int(os.getenv("REMINDER_BATCH", 100))                # reminders per send() call
+REMINDER_TICK = float(os.getenv("REMINDER_TICK", 30))                 # max seconds between looks at the store
+REMINDER_DB = os.getenv("REMINDER_DB", "reminders.sqlite3")
+REMINDER_SINK = os.getenv("REMINDER_SINK", "file:reminders_outbox.jsonl")
+RETRY_DELAY = 60
+TIME_FORMATS = ["%I:%M %p", "%H:%M"]
+
+PENDING = metrics.counter("reminders_scheduled_total", "Reminders put on the schedule")
+SENT = metrics.counter("reminders_sent_total", "Reminders handed to the sender")
+FAILED = metrics.counter("reminder_send_failures_total", "send() calls that raised; their batch is retried")
+
+
+# Dates and slots repeat across thousands of bookings and strptime is slow
+# (it dominated the startup replay), so both are parsed once per distinct
+# value
+_parse_day = lru_cache(maxsize=4096)(parse_date)
+
+@lru_cache(maxsize=1024)
+def _slot_time(slot):
+    for fmt in TIME_FORMATS:
+        try:
+            return datetime.strptime(slot, fmt).time()
+        except ValueError:
+            pass
+    return Time()
+
+# When the appointment starts; a missing or unreadable time slot counts as
+# the start of the day, so its reminder goes out early rather than late
+def appointment_time(record):
+    if record.get("type", "appointment") != "appointment":
+        return None
+    day = _parse_day(str(record.get("date") or ""))
+    if day is None:
+        return None
+    return datetime.combine(day, _slot_time(str(record.get("time_slot") or "").strip().upper()))
+
+def reminder_message(record, at):
+    return (f"Reminder: your appointment with {record.get('doctor', '')} ({record.get('department', '')}) "
+            f"is on {at:%d/%m/%Y} at {record.get('time_slot', '')}. "
+            "Warm regards, Avenir Fertility Clinic")
+
+
+# ---------- Senders ----------
+# A sender has send(reminders) for a list of reminder dicts and raises if
+# the batch did not go out (the whole batch is retried later). This one
+# appends them to a JSONL file, for local runs and tests; a WhatsApp/SMS
+# gateway client just needs the same method.
+class FileSender:
+    def __init__(self, path):
+        self.path = path
+
+    def send(self, reminders):
+        lines = "".join(json.dumps(r, ensure_ascii=False) + "\n" for r in reminders)
+        with open(self.path, "a", encoding="utf-8") as f:
+            f.write(lines)
+
+SENDERS = {
+    "file": FileSender,
+}
+
+# spec is "<sender>:<location>", e.g. "file:reminders_outbox.jsonl"
+def open_sender(spec=REMINDER_SINK):
+    kind, _, location = spec.partition(":")
+    if kind not in SENDERS:
+        raise ValueError(f"Unknown reminder sender: {kind}")
+    return SENDERS[kind](location)
+
+
+# ---------- Sent log ----------
+# Keys of reminders already sent, so a restart (which replays the store)
+# doesn't send them again. Rows for appointments in the past are pruned.
+class SentLog:
+    def __init__(self, path=REMINDER_DB):
+        self.path = path
+        with closing(self._connect()) as db, db:
+            db.execute("PRAGMA journal_mode=WAL")
+            db.execute("CREATE TABLE IF NOT EXISTS sent (key TEXT PRIMARY KEY, appointment_at REAL NOT NULL)")
+            db.execute("CREATE INDEX IF NOT EXISTS sent_at ON sent(appointment_at)")
+
+    def _connect(self):
+        return sqlite3.connect(self.path, timeout=30)
+
+    def upcoming(self, now):
+        with closing(self._connect()) as db:
+            return {key for key, in db.execute("SELECT key FROM sent WHERE appointment_at >= ?", (now,))}
+
+    def add(self, items):
+        with closing(self._connect()) as db, db:
+            db.executemany("INSERT OR IGNORE INTO sent (key, appointment_at) VALUES (?, ?)", items)
+
+    def prune(self, now):
+        with closing(self._connect()) as db, db:
+            return db.execute("DELETE FROM sent WHERE appointment_at < ?", (now,)).rowcount
+
+
+# ---------- Scheduler ----------
+# Min-heap of (send at, key, locator, appointment time) fed as a store
+# listener, so bookings are scheduled as they commit and the store is never
+# rescanned: a tick only pops what is due. Entries hold the locator, not the
+# record, which keeps 100k+ pending reminders small; the record is read back
+# when its reminder goes out. Appointments already past are skipped;
+# reminders whose time passed but whose appointment hasn't are due at once.
+class ReminderScheduler:
+    def __init__(self, store, sender, sent=None, lead=REMINDER_LEAD, batch_size=REMINDER_BATCH, tick=REMINDER_TICK):
+        self.store = store
+        self.sender = sender
+        self.sent = sent if sent is not None else SentLog()
+        self.lead = lead
+        self.batch_size = batch_size
+        self.tick = tick
+        self._heap = []
+        self._lock = threading.Lock()
+        self._wake = threading.Event()
+        self._stop = threading.Event()
+        self._thread = None
+        self._sent_keys = self.sent.upcoming(time.time())
+        metrics.gauge("reminders_pending", "Reminders waiting to be sent", lambda: len(self))
+
+    # Store listener
+    def __call__(self, entries):
+        now = time.time()
+        items = []
+        for loc, record in entries:
+            at = appointment_time(record)
+            if at is None:
+                continue
+            at = at.timestamp()
+            if at <= now:
+                continue
+            key = json.dumps(loc)
+            if key in self._sent_keys:
+                continue
+            items.append((at - self.lead, key, loc, at))
+        if not items:
+            return
+        PENDING.inc(len(items))
+        with self._lock:
+            # The startup replay comes in large batches: heapify once
+            # instead of pushing one by one
+            if len(items) > len(self._heap):
+                self._heap.extend(items)
+                heapq.heapify(self._heap)
+            else:
+                for item in items:
+                    heapq.heappush(self._heap, item)
+            earliest = self._heap[0][0]
+        if earliest <= now + self.tick:
+            self._wake.set()
+
+    def _pop_due(self, now):
+        with self._lock:
+            due = []
+            while self._heap and self._heap[0][0] <= now and len(due) < self.batch_size:
+                due.append(heapq.heappop(self._heap))
+            return due
+
+    def _reminder(self, item):
+        _, key, loc, at = item
+        record = self.store.read_at(loc)
+        at = datetime.fromtimestamp(at)
+        return {
+            "key": key,
+            "first_name": record.get("first_name", ""),
+            "last_name": record.get("last_name", ""),
+            "mobile": record.get("mobile", ""),
+            "email": record.get("email", ""),
+            "doctor": record.get("doctor", ""),
+            "department": record.get("department", ""),
+            "date": record.get("date", ""),
+            "time_slot": record.get("time_slot", ""),
+            "appointment_at": at.isoformat(),
+            "message": reminder_message(record, at),
+        }
+
+    # Sends everything due at now in batches; returns how many went out. A
+    # failed batch goes back on the heap RETRY_DELAY seconds later.
+    def dispatch(self, now=None):
+        now = time.time() if now is None else now
+        sent = 0
+        while True:
+            due = self._pop_due(now)
+            if not due:
+                return sent
+            try:
+                self.sender.send([self._reminder(item) for item in due])
+            except Exception as e:
+                FAILED.inc()
+                log.warning("Sending %d reminders failed: %s", len(due), e)
+                with self._lock:
+                    for _, key, loc, at in due:
+                        heapq.heappush(self._heap, (now + RETRY_DELAY, key, loc, at))
+                return sent
+            self.sent.add([(key, at) for _, key, _, at in due])
+            self._sent_keys.update(key for _, key, _, _ in due)
+            SENT.inc(len(due))
+            sent += len(due)
+
+    # Seconds until the next reminder is due, capped at the tick
+    def _wait_time(self):
+        with self._lock:
+            if not self._heap:
+                return self.tick
+            return min(self.tick, max(0.0, self._heap[0][0] - time.time()))
+
+    def run_once(self):
+        # Picks up bookings written by other processes; the listener does
+        # the scheduling
+        self.store.refresh()
+        return self.dispatch()
+
+    def _run(self):
+        last_prune = 0.0
+        while not self._stop.is_set():
+            try:
+                self.run_once()
+                if time.time() - last_prune > 3600:
+                    last_prune = time.time()
+                    self.sent.prune(last_prune)
+                    self._sent_keys = self.sent.upcoming(last_prune)
+            except Exception:
+                log.exception("Reminder tick failed")
+            self._wake.wait(self._wait_time())
+            self._wake.clear()
+
+    def start(self):
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, name="reminders", daemon=True)
+            self._thread.start()
+
+    def stop(self, timeout=5):
+        self._stop.set()
+        self._wake.set()
+        if self._thread is not None:
+            self._thread.join(timeout)
+            self._thread = None
+
+    def __len__(self):
+        return len(self._heap)
+
+
+# Standalone service next to the API (one per deployment, so each reminder
+# is sent once):  python reminders.py [--once]
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    store = open_store()
+    scheduler = ReminderScheduler(store, open_sender())
+    store.add_listener(scheduler)
+    store.load()
+    log.info("%d reminders pending", len(scheduler))
+    if "--once" in sys.argv[1:]:
+        print(f"Sent {scheduler.dispatch()} reminders")
+    else:
+        scheduler.start()
+        try:
+            while True:
+                time.sleep(3600)
+        except KeyboardInterrupt:
+            scheduler.stop()
@@ -0,0 +1,170 @@
+# schedule.py
+import json
+import os
+import threading
+from datetime import date, timedelta
+from appointment_store import parse_date
+from occupancy import slot_key
+
+# ---------- Clinic schedule ----------
+CLINIC_DAYS = [0, 1, 2, 3, 4, 5]    # Mon-Sat
+HORIZON_DAYS = 60                   # how far ahead availability is precomputed
+SCHEDULE_EXCEPTIONS = os.getenv("SCHEDULE_EXCEPTIONS", "schedule_exceptions.json")
+
+# Weekly template per doctor: the same slots on every clinic day unless a
+# doctor lists per-weekday slots ({weekday: [slots]})
+DEPARTMENTS = {
+    "Fertility / IVF": {
+        "Dr. Priya Nair": ["10:00 AM", "10:30 AM", "11:00 AM"],
+        "Dr. Rhea Thomas": ["2:00 PM", "3:00 PM", "5:00 PM"],
+        "Dr. Vikram Singh": ["9:00 AM", "1:00 PM", "4:00 PM"],
+    },
+    "Andrology": {
+        "Dr. Arun Menon": ["11:00 AM", "1:00 PM", "4:00 PM"],
+        "Dr. Sanjay Gupta": ["10:30 AM", "2:30 PM", "3:30 PM"],
+        "Dr. Rohit Verma": ["9:30 AM", "12:30 PM", "5:30 PM"],
+    },
+    "Genetic Testing": {
+        "Dr. Meera Kapoor": ["9:30 AM", "10:30 AM", "11:30 AM"],
+        "Dr. Anil Desai": ["1:30 PM", "3:30 PM", "4:30 PM"],
+        "Dr. Leena Shah": ["11:30 AM", "4:30 PM", "5:30 PM"],
+    },
+    "Counselling": {
+        "Dr. Kavita Rao": ["12:00 PM", "2:30 PM", "4:00 PM"],
+        "Dr. Nisha Patel": ["10:00 AM", "1:00 PM", "3:00 PM"],
+        "Dr. Suresh Iyer": ["9:00 AM", "11:00 AM", "5:00 PM"],
+    },
+    "Gynecology / Reproductive Endocrinology": {
+        "Dr. Seema Iyer": ["3:30 PM", "4:30 PM", "5:30 PM"],
+        "Dr. Ananya Sen": ["9:30 AM", "12:30 PM", "2:30 PM"],
+        "Dr. Ritu Malhotra": ["10:30 AM", "1:30 PM", "3:30 PM"],
+    },
+}
+
+
+class NotInSchedule(KeyError):
+    pass
+
+
+# Templates plus date exceptions, indexed by department and doctor.
+# Exceptions map (doctor, date) to the slots offered that day; [] is a day off.
+class Schedule:
+    def __init__(self, departments=DEPARTMENTS, exceptions=None):
+        self.doctors_by_department = {}
+        self.department_of = {}
+        self._weekly = {}
+        for dept, doctors in departments.items():
+            self.doctors_by_department[dept] = list(doctors)
+            for name, slots in doctors.items():
+                self.department_of[name] = dept
+                if isinstance(slots, dict):
+                    self._weekly[name] = {int(d): list(s) for d, s in slots.items()}
+                else:
+                    self._weekly[name] = {d: list(slots) for d in CLINIC_DAYS}
+        self._exceptions = {}
+        for (doctor, day), slots in (exceptions or {}).items():
+            self.set_exception(doctor, day, slots)
+
+    @property
+    def departments(self):
+        return list(self.doctors_by_department)
+
+    def set_exception(self, doctor, day, slots):
+        self._exceptions[(doctor, parse_date(day).isoformat())] = list(slots)
+
+    def slots_for(self, doctor, day):
+        if doctor not in self._weekly:
+            raise NotInSchedule(doctor)
+        override = self._exceptions.get((doctor, day.isoformat()))
+        if override is not None:
+            return override
+        return self._weekly[doctor].get(day.weekday(), [])
+
+
+# Optional JSON file: [{"doctor": ..., "date": "YYYY-MM-DD", "slots": [...]}, ...]
+def load_schedule(exceptions_path=SCHEDULE_EXCEPTIONS):
+    exceptions = {}
+    if exceptions_path and os.path.exists(exceptions_path):
+        with open(exceptions_path, encoding="utf-8") as f:
+            for item in json.load(f):
+                exceptions[(item["doctor"], item["date"])] = item.get("slots", [])
+    return Schedule(DEPARTMENTS, exceptions)
+
+
+# ---------- Availability ----------
+# Free slots per (doctor, date) = schedule minus occupancy. Windows for the
+# next HORIZON_DAYS are precomputed; as a store listener, each committed
+# booking just drops its slot from the one affected window.
+class Availability:
+    def __init__(self, schedule, occupancy, horizon_days=HORIZON_DAYS):
+        self.schedule = schedule
+        self.occupancy = occupancy
+        self.horizon_days = horizon_days
+        self._windows = {}
+        self._lock = threading.Lock()
+
+    def _in_horizon(self, day):
+        today = date.today()
+        return today <= day <= today + timedelta(days=self.horizon_days)
+
+    def _compute(self, doctor, day):
+        taken = self.occupancy.taken_slots(doctor, day.isoformat())
+        return [s for s in self.schedule.slots_for(doctor, day) if s.strip().upper() not in taken]
+
+    def precompute(self):
+        today = date.today()
+        for doctor in self.schedule.department_of:
+            for n in range(self.horizon_days + 1):
+                self.free_slots(doctor, today + timedelta(days=n))
+
+    # Store listener
+    def __call__(self, entries):
+        with self._lock:
+            for _, record in entries:
+                key = slot_key(record)
+                if key is None:
+                    continue
+                window = self._windows.get(key[:2])
+                if window is not None:
+                    self._windows[key[:2]] = [s for s in window if s.strip().upper() != key[2]]
+
+    def free_slots(self, doctor, day):
+        if day < date.today():
+            return []
+        key = (doctor, day.isoformat())
+        window = self._windows.get(key)
+        if window is None:
+            # Computed under the lock so a booking landing meanwhile is
+            # either already in the occupancy index or removed right after
+            with self._lock:
+                window = self._compute(doctor, day)
+                if self._in_horizon(day):
+                    self._windows[key] = window
+        return list(window)
+
+    # Same shape as GET /api/availability
+    def query(self, department=None, doctor=None, date_from=None, date_to=None):
+        if doctor is not None:
+            if doctor not in self.schedule.department_of:
+                raise NotInSchedule(doctor)
+            department = department or self.schedule.department_of[doctor]
+        if department is not None and department not in self.schedule.doctors_by_department:
+            raise NotInSchedule(department)
+        depts = [department] if department else self.schedule.departments
+        directory = {d: self.schedule.doctors_by_department[d] for d in depts}
+
+        windows = []
+        if date_from is not None:
+            date_to = date_to or date_from
+            doctors = [doctor] if doctor else [n for d in depts for n in directory[d]]
+            day = date_from
+            while day <= date_to:
+                for name in doctors:
+                    windows.append({
+                        "department": self.schedule.department_of[name],
+                        "doctor": name,
+                        "date": day.isoformat(),
+                        "slots": self.free_slots(name, day),
+                    })
+                day += timedelta(days=1)
+        return {"departments": directory, "windows": windows}
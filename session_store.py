@@ -0,0 +1,74 @@
+# session_store.py
+import json
+import os
+import sqlite3
+import time
+from contextlib import closing
+
+# ---------- Configuration ----------
+SESSION_DB = os.getenv("SESSION_DB", "sessions.sqlite3")
+TRANSCRIPT_MAX = int(os.getenv("SESSION_TRANSCRIPT_MAX", 100))      # messages kept per session
+SESSION_IDLE_TTL = int(os.getenv("SESSION_IDLE_TTL", 7 * 24 * 3600))  # seconds before an idle session goes
+EVICT_INTERVAL = 600
+
+
+# Keep the last max_messages of the transcript; "dropped" counts the rest
+def compact(state, max_messages=TRANSCRIPT_MAX):
+    messages = state.get("messages") or []
+    if len(messages) <= max_messages:
+        return state
+    extra = len(messages) - max_messages
+    return dict(state, messages=messages[extra:], dropped=state.get("dropped", 0) + extra)
+
+
+# ---------- Session store ----------
+# Conversation state shared by every app replica: one JSON document per
+# session id in SQLite (WAL, so readers never wait for a writer). Transcripts
+# are compacted on save and sessions idle for longer than idle_ttl are
+# evicted, so the database stays bounded by active conversations.
+class SessionStore:
+    def __init__(self, path=SESSION_DB, max_messages=TRANSCRIPT_MAX, idle_ttl=SESSION_IDLE_TTL):
+        self.path = path
+        self.max_messages = max_messages
+        self.idle_ttl = idle_ttl
+        self._last_evict = 0.0
+        with closing(self._connect()) as db, db:
+            db.execute("PRAGMA journal_mode=WAL")
+            db.execute("""CREATE TABLE IF NOT EXISTS sessions (
+                id TEXT PRIMARY KEY,
+                state TEXT NOT NULL,
+                updated_at REAL NOT NULL)""")
+            db.execute("CREATE INDEX IF NOT EXISTS sessions_idle ON sessions(updated_at)")
+
+    def _connect(self):
+        return sqlite3.connect(self.path, timeout=30)
+
+    def load(self, session_id):
+        with closing(self._connect()) as db:
+            row = db.execute("SELECT state, updated_at FROM sessions WHERE id = ?", (session_id,)).fetchone()
+        if row is None or row[1] < time.time() - self.idle_ttl:
+            return None
+        return json.loads(row[0])
+
+    # Saves the compacted state and returns it
+    def save(self, session_id, state):
+        state = compact(state, self.max_messages)
+        with closing(self._connect()) as db, db:
+            db.execute("INSERT OR REPLACE INTO sessions (id, state, updated_at) VALUES (?, ?, ?)",
+                       (session_id, json.dumps(state, ensure_ascii=False), time.time()))
+        if time.time() - self._last_evict > EVICT_INTERVAL:
+            self.evict_idle()
+        return state
+
+    def delete(self, session_id):
+        with closing(self._connect()) as db, db:
+            db.execute("DELETE FROM sessions WHERE id = ?", (session_id,))
+
+    def evict_idle(self):
+        self._last_evict = time.time()
+        with closing(self._connect()) as db, db:
+            return db.execute("DELETE FROM sessions WHERE updated_at < ?", (time.time() - self.idle_ttl,)).rowcount
+
+    def __len__(self):
+        with closing(self._connect()) as db:
+            return db.execute("SELECT COUNT(*) FROM sessions").fetchone()[0]
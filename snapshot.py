@@ -0,0 +1,64 @@
+# snapshot.py
+import itertools
+import threading
+import time
+import orjson
+from idempotency import without_key
+
+# ---------- Listing snapshot ----------
+# The unfiltered GET /api/appointments body, kept serialized in memory. As a
+# store listener it adds each commit's rows as one immutable chunk, so a
+# write costs O(batch) and a read only pins how many chunks its version has:
+# the body is streamed from the chunks themselves, never copied whole.
+WRITE_SIZE = 64 * 1024
+
+class ListingSnapshot:
+    def __init__(self, type="appointment"):
+        self.type = type
+        self._chunks = []
+        self._size = 0
+        self._count = 0
+        self._version = 0
+        # Keeps ETags from one process lifetime from matching another's
+        self._epoch = format(time.time_ns(), "x")
+        self._lock = threading.Lock()
+
+    # Store listener
+    def __call__(self, entries):
+        rows = [orjson.dumps(without_key(r)) for _, r in entries if r.get("type", "appointment") == self.type]
+        if not rows:
+            return
+        chunk = b",".join(rows)
+        with self._lock:
+            if self._count:
+                chunk = b"," + chunk
+            self._chunks.append(chunk)
+            self._size += len(chunk)
+            self._count += len(rows)
+            self._version += 1
+
+    @property
+    def etag(self):
+        return f'"{self._epoch}-{self._version}"'
+
+    # (etag, byte length, iterator over the JSON array) of the same version.
+    # Chunks are only ever appended, so the iterator stops at the ones this
+    # version had and later commits don't show up in it.
+    def body(self):
+        with self._lock:
+            return self.etag, self._size + 2, self._parts(len(self._chunks))
+
+    # Writes of about WRITE_SIZE bytes rather than one per commit
+    def _parts(self, n):
+        out, size = [b"["], 1
+        for chunk in itertools.islice(self._chunks, n):
+            out.append(chunk)
+            size += len(chunk)
+            if size >= WRITE_SIZE:
+                yield b"".join(out)
+                out, size = [], 0
+        out.append(b"]")
+        yield b"".join(out)
+
+    def __len__(self):
+        return self._count
@@ -0,0 +1,57 @@
+# stats.py
+import threading
+from collections import Counter
+from datetime import timedelta
+from appointment_store import parse_date
+
+
+# ---------- Booking stats ----------
+# Counters kept current as a listener on both the appointment and the
+# callback store (rebuilt by the startup replay), so reading them never
+# touches the stores. Appointments are counted per department, per doctor
+# and per appointment date; callbacks per preferred contact method.
+class BookingStats:
+    def __init__(self):
+        self.appointments = 0
+        self.callbacks = 0
+        self.by_department = Counter()
+        self.by_doctor = Counter()
+        self.by_day = Counter()
+        self.callbacks_by_preference = Counter()
+        self._lock = threading.Lock()
+
+    # Store listener
+    def __call__(self, entries):
+        with self._lock:
+            for _, record in entries:
+                kind = record.get("type", "appointment")
+                if kind == "appointment":
+                    self.appointments += 1
+                    self.by_department[record.get("department") or "unknown"] += 1
+                    self.by_doctor[record.get("doctor") or "unknown"] += 1
+                    day = parse_date(record.get("date"))
+                    if day is not None:
+                        self.by_day[day.isoformat()] += 1
+                elif kind == "expert_callback":
+                    self.callbacks += 1
+                    self.callbacks_by_preference[record.get("preference") or "unknown"] += 1
+
+    # Per-day counts only for [date_from, date_to], so the cost of a read
+    # depends on the window, not on how much history has piled up
+    def snapshot(self, date_from, date_to):
+        with self._lock:
+            days = {}
+            day = date_from
+            while day <= date_to:
+                n = self.by_day.get(day.isoformat())
+                if n:
+                    days[day.isoformat()] = n
+                day += timedelta(days=1)
+            return {
+                "appointments": self.appointments,
+                "callbacks": self.callbacks,
+                "by_department": dict(self.by_department),
+                "by_doctor": dict(self.by_doctor),
+                "by_day": days,
+                "callbacks_by_preference": dict(self.callbacks_by_preference),
+            }
@@ -1,59 +1,57 @@
 # streamlit_app.py
+import time
+RUN_STARTED = time.perf_counter()   # Streamlit executes this script on every interaction
 import streamlit as st
-import pandas as pd
 import os
-import requests
+import collections
+import copy
+import hashlib
+import itertools
+import uuid
 from datetime import datetime
-from euriai import EuriaiClient
-from dotenv import load_dotenv
-load_dotenv()
+from appointment_store import open_store, migrate, parse_date, CALLBACK_STORE
+from group_commit import GroupCommitter
+from occupancy import OccupancyIndex, SlotTaken, AlreadyBooked
+from schedule import load_schedule, Availability
+from llm_client import LLMClient, TTLCache, EuriClient, FakeEuriaiClient
+from booking_pipeline import BookingPipeline, Outbox, api_client, SYNCED, QUEUED
+import booking_flow
+import metrics
+from session_store import SessionStore, SESSION_DB
+# pandas (about half a second to import) is imported where it is used,
+# httpx when the API and LLM connection pools are first built
+IMPORT_SECONDS = time.perf_counter() - RUN_STARTED   # only the first run of a process pays for imports
+
+# .env is read once per process, not on every rerun
+@st.cache_resource(show_spinner=False)
+def load_env():
+    from dotenv import load_dotenv
+    load_dotenv()
+
+load_env()
 
 # ---------- Configuration ----------
 EURI_KEY = os.environ.get("EURI_API_KEY")
 EURI_MODEL = "gpt-4.1-mini"
+LLM_FAKE = os.getenv("LLM_FAKE", "").lower() in ["1","true","yes"]   # canned local replies
+LLM_FAKE_LATENCY = float(os.getenv("LLM_FAKE_LATENCY", 0))             # seconds before the fake replies
+LLM_CACHE_TTL = int(os.getenv("LLM_CACHE_TTL", 6 * 3600))
 API_BACKEND = os.getenv("POC_API_URL", "http://localhost:8000/api/appointments")
-APPT_CSV = "appointments.csv"
+OUTBOX_DB = os.getenv("POC_OUTBOX_DB", "outbox.sqlite3")
+TRANSCRIPT_WINDOW = int(os.getenv("TRANSCRIPT_WINDOW", 12))   # messages shown before "earlier messages"
+METRICS_PORT = int(os.getenv("METRICS_PORT", 0))   # serve /metrics on this port (0: off)
+SHOW_DIAGNOSTICS = os.getenv("SHOW_DIAGNOSTICS", "").lower() in ["1","true","yes"]   # operator panels in the sidebar
+API_AVAILABILITY = os.getenv("POC_AVAILABILITY_URL", API_BACKEND.rsplit("/api/", 1)[0] + "/api/availability")
 
-# Initialize Euri client
-if not EURI_KEY:
+if not EURI_KEY and not LLM_FAKE:
     st.error("EURI_API_KEY environment variable not found. Please set it and restart.")
     st.stop()
 
-client = EuriaiClient(api_key=EURI_KEY, model=EURI_MODEL)
-
 # ---------- Clinic Data ----------
 CLINIC_LOCATION = "Avenir Fertility Centre, San Diego, California"
 CLINIC_HOURS = "Mon-Sat, 9:00 AM - 7:00 PM"
 CLINIC_PHONE = "+1 (619) 555-0123"
 
-DUMMY_DATA = {
-    "Fertility / IVF": [
-        {"name": "Dr. Priya Nair", "slots": ["10:00 AM", "10:30 AM", "11:00 AM"]},
-        {"name": "Dr. Rhea Thomas", "slots": ["2:00 PM", "3:00 PM", "5:00 PM"]},
-        {"name": "Dr. Vikram Singh", "slots": ["9:00 AM", "1:00 PM", "4:00 PM"]}
-    ],
-    "Andrology": [
-        {"name": "Dr. Arun Menon", "slots": ["11:00 AM", "1:00 PM", "4:00 PM"]},
-        {"name": "Dr. Sanjay Gupta", "slots": ["10:30 AM", "2:30 PM", "3:30 PM"]},
-        {"name": "Dr. Rohit Verma", "slots": ["9:30 AM", "12:30 PM", "5:30 PM"]}
-    ],
-    "Genetic Testing": [
-        {"name": "Dr. Meera Kapoor", "slots": ["9:30 AM", "10:30 AM","11:30 AM"]},
-        {"name": "Dr. Anil Desai", "slots": ["1:30 PM", "3:30 PM", "4:30 PM"]},
-        {"name": "Dr. Leena Shah", "slots": ["11:30 AM", "4:30 PM", "5:30 PM"]}
-    ],
-    "Counselling": [
-        {"name": "Dr. Kavita Rao", "slots": ["12:00 PM", "2:30 PM", "4:00 PM"]},
-        {"name": "Dr. Nisha Patel", "slots": ["10:00 AM", "1:00 PM", "3:00 PM"]},
-        {"name": "Dr. Suresh Iyer", "slots": ["9:00 AM", "11:00 AM", "5:00 PM"]}
-    ],
-    "Gynecology / Reproductive Endocrinology": [
-        {"name": "Dr. Seema Iyer", "slots": ["3:30 PM", "4:30 PM","5:30 PM"]},
-        {"name": "Dr. Ananya Sen", "slots": ["9:30 AM", "12:30 PM", "2:30 PM"]},
-        {"name": "Dr. Ritu Malhotra", "slots": ["10:30 AM", "1:30 PM", "3:30 PM"]}
-    ]
-}
-
 TREATMENT_COSTS = {
     "IVF / ICSI": "$12,00 - $15,00",
     "IUI": "$800 - $1,200",
@@ -63,43 +61,220 @@ TREATMENT_COSTS = {
     "Donor Programs": "$20,00 - $30,00"
 }
 
-# Ensure CSV file exists
-if not os.path.exists(APPT_CSV):
-    df_init = pd.DataFrame(columns=[
-        "first_name","last_name","sex","mobile","dob","email",
-        "partner_included","partner_first","partner_last","department",
-        "doctor","date","time_slot","reason","summary","created_at"
-    ])
-    df_init.to_csv(APPT_CSV, index=False)
+# ---------- LLM Content ----------
+# Prompts that are the same for every user, with their generation params
+LOCATION_PROMPT = ("""Generate a brief, welcoming description of a fertility clinic location in San Diego, California. 
+        Include positive aspects about accessibility, neighborhood, and facilities. Keep it to 2-3 sentences.""",
+    {"temperature": 0.3, "max_tokens": 100})
+
+STORIES_PROMPT = ("""Generate 2 brief, inspiring fertility treatment success stories (2-3 sentences each). 
+        Make them positive and hopeful, but keep them generic without specific names.""",
+    {"temperature": 0.4, "max_tokens": 200})
+
+LOCATION_FALLBACK = "Our state-of-the-art facility in San Diego offers comfortable, private consultation rooms and advanced medical equipment."
+
+STORIES_FALLBACK = """
+        *"After years of trying, the compassionate team at Avenir helped us welcome our beautiful daughter. The entire journey was supported with care and expertise."*
+        
+        *"The genetic testing and IVF treatment gave us the confidence we needed. We're now expecting twins and couldn't be happier with our decision."*
+        """
+
+TREATMENT_FALLBACK = "This treatment helps patients on their fertility journey. Our specialists can provide detailed information during your consultation."
+
+def treatment_prompt(treatment):
+    return (f"""Provide a concise 2-3 sentence description of {treatment} fertility treatment. 
+            Focus on what the treatment involves and who it's for. Keep it patient-friendly and informative.""",
+        {"temperature": 0.3, "max_tokens": 150})
+
+# Initialize Euri client once per process; completions of the static prompts
+# are cached for everyone and generated in the background at startup
+@st.cache_resource(show_spinner=False)
+def get_llm():
+    if LLM_FAKE:
+        client = FakeEuriaiClient(latency=LLM_FAKE_LATENCY, chunk_delay=0.05)
+    else:
+        client = EuriClient(api_key=EURI_KEY, model=EURI_MODEL)
+    llm = LLMClient(client, TTLCache(ttl=LLM_CACHE_TTL))
+    llm.warm_up([LOCATION_PROMPT, STORIES_PROMPT] + [treatment_prompt(t) for t in TREATMENT_COSTS])
+    metrics.gauge("llm_cache_entries", "Completions in the LLM response cache", lambda: len(llm.cache))
+    metrics.gauge("llm_circuit_open", "1 while the LLM circuit breaker is not closed",
+                  lambda: int(llm.breaker.state != "closed"))
+    return llm
+
+llm = get_llm()
+
+# Append-only appointment store, its slot occupancy index, local
+# availability (used when the API is unreachable) and its single writer,
+# plus the callback-request store, shared by all sessions of this process
+@st.cache_resource(show_spinner=False)
+def get_backend():
+    store = open_store()
+    callbacks = open_store(CALLBACK_STORE)
+    occupancy = OccupancyIndex()
+    availability = Availability(load_schedule(), occupancy)
+    store.add_listener(occupancy)
+    store.add_listener(availability)
+    migrate(store, callbacks)
+    store.load()
+    return store, availability, GroupCommitter(store, checks=[occupancy.check]), GroupCommitter(callbacks)
+
+store, availability, committer, callback_committer = get_backend()
+
+# One keep-alive connection pool to the API for the whole process
+@st.cache_resource(show_spinner=False)
+def get_http():
+    return api_client()
+
+http = get_http()
+
+# Background side effects of confirmed bookings (API sync with a durable
+# outbox, confirmation text)
+@st.cache_resource(show_spinner=False)
+def get_pipeline():
+    pipeline = BookingPipeline(API_BACKEND, Outbox(OUTBOX_DB), client=http)
+    pipeline.start()
+    return pipeline
+
+pipeline = get_pipeline()
+
+# Prometheus scrape endpoint for this process (store timers and the per-menu
+# LLM counters), started once
+@st.cache_resource(show_spinner=False)
+def get_metrics_server():
+    return metrics.serve(METRICS_PORT) if METRICS_PORT else None
+
+get_metrics_server()
+
+# Departments, doctors and free slots come from GET /api/availability
+def fetch_availability(department=None, doctor=None, date=None):
+    params = {k: v for k, v in {"department": department, "doctor": doctor, "date": date}.items() if v}
+    try:
+        r = http.get(API_AVAILABILITY, params=params, timeout=3)
+        r.raise_for_status()
+        return r.json()
+    except Exception:
+        store.refresh()
+        return availability.query(department, doctor, parse_date(date) if date else None)
+
+# The doctor directory rarely changes; don't ask for it on every rerun
+@st.cache_data(ttl=300, show_spinner=False)
+def fetch_directory(department=None):
+    return fetch_availability(department=department)["departments"]
 
 # ---------- Streamlit UI ----------
 st.set_page_config(page_title="Avenir Fertility Clinic", layout="centered")
 st.title("🏥 Avenir Fertility Clinic - San Diego")
 st.write("**Your journey to parenthood begins here. We're here to help you every step of the way.**")
 
-# Initialize session state
-if "step" not in st.session_state:
-    st.session_state.step = 0
-    st.session_state.form = {}
-    st.session_state.messages = []
-    st.session_state.current_menu = "main"
-    st.session_state.welcome_shown = False
+# Operator view of the shared LLM client: cache, coalescing, deadline and
+# circuit breaker state. Patients don't see it; operators turn it on with
+# SHOW_DIAGNOSTICS=1 (the same numbers are on /metrics).
+if SHOW_DIAGNOSTICS:
+    with st.sidebar.expander("⚙️ Assistant status"):
+        st.json(llm.stats())
+    timing_slot = st.sidebar.empty()
+
+# Conversation state lives in the shared session store under the "sid" query
+# parameter, so any replica behind the load balancer can carry a
+# conversation on: a process that hasn't seen the session restores it, and
+# every run saves what changed. pending_confirmation (a live background
+# dispatch) stays with the process that started it.
+PERSISTED_STATE = ("messages", "dropped", "current_menu", "welcome_shown", "booking")
+
+@st.cache_resource(show_spinner=False)
+def get_sessions():
+    return SessionStore(SESSION_DB)
+
+# The sid alone doesn't give access to a transcript (it is in every shared
+# or logged URL): a session is saved with a hash of the browser's XSRF
+# token, which Streamlit keeps in a cookie, and only that browser restores
+# it. Tornado masks the token afresh on each page load ("2|mask|masked|ts"),
+# so it is unmasked first. Without the cookie nothing is restored.
+def browser_owner():
+    cookie = st.context.cookies.get("_streamlit_xsrf")
+    if not cookie:
+        return None
+    try:
+        version, mask, masked, _ = cookie.split("|")
+        mask, masked = bytes.fromhex(mask), bytes.fromhex(masked)
+    except ValueError:
+        return None
+    if version != "2" or not mask:
+        return None
+    token = bytes(b ^ mask[i % len(mask)] for i, b in enumerate(masked))
+    return hashlib.sha256(token).hexdigest()
+
+sessions = get_sessions()
+owner = browser_owner()
+sid = st.query_params.get("sid")
+if not sid or len(sid) > 64:
+    sid = uuid.uuid4().hex
+    st.query_params["sid"] = sid
+
+# Initialize session state. A sid saved by another browser (or one that
+# can't be told apart) starts a new session rather than overwriting it.
+if "current_menu" not in st.session_state:
+    saved = sessions.load(sid)
+    if saved is not None and (owner is None or saved.get("owner") != owner):
+        sid = uuid.uuid4().hex
+        st.query_params["sid"] = sid
+        saved = None
+    saved = saved or {}
+    st.session_state.booking = saved.get("booking")
+    st.session_state.messages = saved.get("messages", [])
+    st.session_state.dropped = saved.get("dropped", 0)
+    st.session_state.current_menu = saved.get("current_menu", "main")
+    st.session_state.welcome_shown = saved.get("welcome_shown", False)
+
+# Writes the conversation back (transcript compacted) if it changed. Runs at
+# the start of every run, which catches changes made before an st.rerun(),
+# and at the end of the script.
+def save_session():
+    state = {k: st.session_state[k] for k in PERSISTED_STATE}
+    state["owner"] = owner
+    if state == st.session_state.get("saved_state"):
+        return
+    state = sessions.save(sid, state)
+    st.session_state.messages = state["messages"]
+    st.session_state.dropped = state.get("dropped", 0)
+    st.session_state.saved_state = copy.deepcopy(state)
+
+save_session()
 
 # Helper to add bot message
 def bot_say(text):
     st.session_state.messages.append({"who":"bot","text":text})
 
+# Helper to stream a bot message as it is generated; the full text is kept
+# in the transcript once the stream ends
+def bot_stream(chunks, prefix=""):
+    with live_message.container():
+        text = st.write_stream(itertools.chain([prefix], chunks) if prefix else chunks)
+    bot_say(text if isinstance(text, str) else "".join(map(str, text)))
+
 # Helper to add user message
 def user_say(text):
     st.session_state.messages.append({"who":"user","text":text})
 
-# Show messages
+# Markdown for one transcript message
+def message_markdown(who, text):
+    return text if who == "bot" else f"**You:** {text}"
+
+# Show the last TRANSCRIPT_WINDOW messages, plus a slot right after them for
+# a message being streamed. Older ones are only rendered (as one block) when
+# the user asks for them, so a rerun costs the window, not the history.
 def render_messages():
-    for i, m in enumerate(st.session_state.messages):
-        if m["who"] == "bot":
-            st.markdown(f"{m['text']}")
-        else:
-            st.markdown(f"**You:** {m['text']}")
+    global live_message
+    messages = st.session_state.messages
+    older = messages[:-TRANSCRIPT_WINDOW]
+    if st.session_state.dropped:
+        st.caption(f"{st.session_state.dropped} earlier messages are no longer shown.")
+    if older and st.toggle(f"Show {len(older)} earlier messages", key="show_earlier"):
+        with st.container(border=True):
+            st.markdown("\n\n".join(message_markdown(m["who"], m["text"]) for m in older))
+    for m in messages[-TRANSCRIPT_WINDOW:]:
+        st.markdown(message_markdown(m["who"], m["text"]))
+    live_message = st.empty()
 
 # Main menu options - show only once
 def show_main_menu():
@@ -133,7 +308,7 @@ Our treatment plans are customized based on your medical needs. Here are estimat
         if st.button("📅 Book Consultation", key="cost_book"):
             user_say("Book an Appointment")
             st.session_state.current_menu = "appointment"
-            st.session_state.step = 1
+            st.session_state.booking = booking_flow.start()
             st.rerun()
     with col2:
         if st.button("🔙 Back to Main", key="cost_back"):
@@ -152,14 +327,8 @@ def show_location_info():
 We're conveniently located in San Diego with ample parking and easy access.""")
     
     # Generate location description using EURI
-    try:
-        location_prompt = f"""Generate a brief, welcoming description of a fertility clinic location in San Diego, California. 
-        Include positive aspects about accessibility, neighborhood, and facilities. Keep it to 2-3 sentences."""
-        resp = client.generate_completion(prompt=location_prompt, temperature=0.3, max_tokens=100)
-        location_desc = resp.get("choices", [{}])[0].get("message", {}).get("content", "")
-        st.write(location_desc)
-    except:
-        st.write("Our state-of-the-art facility in San Diego offers comfortable, private consultation rooms and advanced medical equipment.")
+    prompt, params = LOCATION_PROMPT
+    st.write(llm.complete(prompt, **params, fallback=LOCATION_FALLBACK, menu="location"))
     
     st.markdown("---")
     col1, col2 = st.columns(2)
@@ -167,7 +336,7 @@ We're conveniently located in San Diego with ample parking and easy access.""")
         if st.button("📅 Book Appointment", key="loc_book"):
             user_say("Book an Appointment")
             st.session_state.current_menu = "appointment"
-            st.session_state.step = 1
+            st.session_state.booking = booking_flow.start()
             st.rerun()
     with col2:
         if st.button("🔙 Back to Main", key="loc_back"):
@@ -186,14 +355,8 @@ Which treatment would you like to know more about?""")
     if st.button("Get Treatment Info", key="treatment_info"):
         user_say(f"Learn about {treatment}")
         
-        try:
-            prompt = f"""Provide a concise 2-3 sentence description of {treatment} fertility treatment. 
-            Focus on what the treatment involves and who it's for. Keep it patient-friendly and informative."""
-            resp = client.generate_completion(prompt=prompt, temperature=0.3, max_tokens=150)
-            treatment_info = resp.get("choices", [{}])[0].get("message", {}).get("content", "")
-            bot_say(f"**{treatment}**\n\n{treatment_info}")
-        except Exception as e:
-            bot_say(f"**{treatment}**\n\nThis treatment helps patients on their fertility journey. Our specialists can provide detailed information during your consultation.")
+        prompt, params = treatment_prompt(treatment)
+        bot_stream(llm.stream(prompt, **params, fallback=TREATMENT_FALLBACK, menu="treatments"), prefix=f"**{treatment}**\n\n")
         
         st.rerun()
     
@@ -203,7 +366,7 @@ Which treatment would you like to know more about?""")
         if st.button("📅 Book Consultation", key="treat_book"):
             user_say("Book an Appointment")
             st.session_state.current_menu = "appointment"
-            st.session_state.step = 1
+            st.session_state.booking = booking_flow.start()
             st.rerun()
     with col2:
         if st.button("🔙 Back to Main", key="treat_back"):
@@ -231,18 +394,15 @@ We'd be happy to connect you with our fertility specialists! Please share your d
             user_say(f"Requested callback from {exp_name}")
             
             # Generate confirmation message using EURI
-            try:
-                prompt = f"""Create a warm confirmation message for a fertility clinic callback request. 
+            prompt = f"""Create a warm confirmation message for a fertility clinic callback request. 
                 Include: thanking the patient by name, confirming contact method, and reassuring them about the callback timing.
                 End with: Warm regards, Avenir Fertility Clinic
                 
                 Patient: {exp_name}
                 Contact: {exp_phone}
                 Method: {exp_preference}"""
-                resp = client.generate_completion(prompt=prompt, temperature=0.2, max_tokens=150)
-                callback_msg = resp.get("choices", [{}])[0].get("message", {}).get("content", "")
-            except:
-                callback_msg = f"Thank you {exp_name}! Our fertility expert will contact you within 24 hours at {exp_phone} via {exp_preference.lower()}.\n\nWarm regards,\nAvenir Fertility Clinic Thank you for connecting with Avenir Fertility!"
+            fallback = f"Thank you {exp_name}! Our fertility expert will contact you within 24 hours at {exp_phone} via {exp_preference.lower()}.\n\nWarm regards,\nAvenir Fertility Clinic Thank you for connecting with Avenir Fertility!"
+            callback_msg = llm.complete(prompt, temperature=0.2, max_tokens=150, cache=False, fallback=fallback, menu="expert")
             
             bot_say(callback_msg)
             
@@ -256,11 +416,9 @@ We'd be happy to connect you with our fertility specialists! Please share your d
                 "created_at": datetime.now().isoformat()
             }
             
-            # Append to CSV or database
+            # Append to the callback store
             try:
-                callback_df = pd.read_csv(APPT_CSV)
-                callback_df = pd.concat([callback_df, pd.DataFrame([callback_record])], ignore_index=True)
-                callback_df.to_csv(APPT_CSV, index=False)
+                callback_committer.commit(callback_record)
             except Exception as e:
                 st.error(f"Error saving callback request: {e}")
             
@@ -281,18 +439,8 @@ def show_success_stories():
 
 Here are some inspiring stories from our patients:""")
     
-    try:
-        stories_prompt = """Generate 2 brief, inspiring fertility treatment success stories (2-3 sentences each). 
-        Make them positive and hopeful, but keep them generic without specific names."""
-        resp = client.generate_completion(prompt=stories_prompt, temperature=0.4, max_tokens=200)
-        stories = resp.get("choices", [{}])[0].get("message", {}).get("content", "")
-        st.write(stories)
-    except:
-        st.write("""
-        *"After years of trying, the compassionate team at Avenir helped us welcome our beautiful daughter. The entire journey was supported with care and expertise."*
-        
-        *"The genetic testing and IVF treatment gave us the confidence we needed. We're now expecting twins and couldn't be happier with our decision."*
-        """)
+    prompt, params = STORIES_PROMPT
+    st.write(llm.complete(prompt, **params, fallback=STORIES_FALLBACK, menu="stories"))
     
     st.markdown("---")
     col1, col2 = st.columns(2)
@@ -300,7 +448,7 @@ Here are some inspiring stories from our patients:""")
         if st.button("📅 Start Your Journey", key="stories_book"):
             user_say("Book an Appointment")
             st.session_state.current_menu = "appointment"
-            st.session_state.step = 1
+            st.session_state.booking = booking_flow.start()
             st.rerun()
     with col2:
         if st.button("🔙 Back to Main", key="stories_back"):
@@ -308,30 +456,57 @@ Here are some inspiring stories from our patients:""")
             st.session_state.current_menu = "main"
             st.rerun()
 
-# Appointment booking flow
-QUESTIONS = [
-    {"key":"first_name","q":"Please enter your first name:"},
-    {"key":"last_name","q":"Please enter your last name:"},
-    {"key":"sex","q":"Sex assigned at birth (Female / Male / Prefer not to say):"},
-    {"key":"mobile","q":"Mobile number (for confirmation):"},
-    {"key":"dob","q":"Date of birth (DD/MM/YYYY):"},
-    {"key":"email","q":"Email ID:"},
-    {"key":"partner_included","q":"Would you like to add partner details? (yes/no)"},
-    {"key":"department","q":"Which department would you like to book an appointment with?"},
-    {"key":"doctor","q":"Choose a doctor from the list:"},
-    {"key":"date","q":"Please pick a preferred Date (DD/MM/YYYY):"},
-    {"key":"time_slot","q":"Please pick a time slot:"},
-    {"key":"reason","q":"Briefly tell us your reason for appointment:"},
-]
-
-def parse_yes_no(val):
-    v = str(val).strip().lower()
-    if v in ["yes","y","true","1"]:
-        return True
-    return False
+# Appointment booking flow: the steps, validation and transitions live in
+# booking_flow; this page renders the current step and feeds it the input
+SUBMIT_LABELS = {9: "Select Department", 10: "Choose Doctor", 11: "Submit Date", 12: "Select slot", 13: "Submit Reason"}
+
+# Departments, doctors and free slots for the choice steps
+def booking_options(field, form):
+    if field == "department":
+        return list(fetch_directory())
+    if field == "doctor":
+        dept = form.get("department")
+        return fetch_directory(dept).get(dept, [])
+    if field == "time_slot":
+        # Free slots for that doctor and date (already booked ones are hidden)
+        windows = fetch_availability(form.get("department"), form.get("doctor"), form.get("date"))["windows"]
+        return windows[0]["slots"] if windows else []
+    return []
+
+# Feed one input to the booking flow. options are the ones on screen, so
+# an answer is checked against exactly what the user picked from.
+def booking_input(state, input, options=()):
+    state, _, errors = booking_flow.advance(state, input, lambda field, form: options)
+    if errors:
+        st.warning(errors[0])
+        return
+    if not isinstance(input, dict):
+        user_say(input.strip())
+    st.session_state.booking = state
+    st.rerun()
+
+# Confirmation of a just-confirmed booking, streamed in while the background
+# dispatch produces it
+@st.fragment(run_every=0.3)
+def show_pending_confirmation():
+    d = st.session_state.pending_confirmation
+    st.markdown(d.text or "⏳ Preparing your confirmation...")
+    if d.done:
+        bot_say(d.text)
+        status = d.sync.result()
+        if status == SYNCED:
+            st.toast("✅ Appointment saved successfully!")
+        elif status == QUEUED:
+            st.toast("✅ Appointment saved locally! It will be synced shortly.")
+        else:
+            st.toast("Appointment saved locally but API returned an error.")
+        del st.session_state.pending_confirmation
+        st.rerun()
 
 # Render appropriate content based on current menu
 render_messages()
+if st.session_state.get("pending_confirmation") is not None:
+    show_pending_confirmation()
 
 # Show main menu buttons only when in main menu
 if st.session_state.current_menu == "main":
@@ -343,7 +518,7 @@ if st.session_state.current_menu == "main":
         if st.button("📅 Book Appointment", use_container_width=True):
             user_say("Book an Appointment")
             st.session_state.current_menu = "appointment"
-            st.session_state.step = 1
+            st.session_state.booking = booking_flow.start()
             st.rerun()
         if st.button("💰 Cost / Packages", use_container_width=True):
             user_say("Cost / Packages")
@@ -380,163 +555,15 @@ elif st.session_state.current_menu == "stories":
     show_success_stories()
 elif st.session_state.current_menu == "appointment":
     st.markdown("---")
-    step = st.session_state.step
-
-    # Appointment booking steps with Enter key support
-    if step >= 1 and step <= 6:
-        q = QUESTIONS[step-1]["q"]
-        user_input = st.text_input(q, key=f"input_{step}")
-        
-        col1, col2 = st.columns([3, 1])
-        with col1:
-            if st.button("Submit", key=f"submit_{step}", use_container_width=True):
-                val = user_input.strip()
-                if not val:
-                    st.warning("Please enter a value.")
-                else:
-                    user_say(val)
-                    st.session_state.form[QUESTIONS[step-1]["key"]] = val
-                    if QUESTIONS[step-1]["key"] == "partner_included" and parse_yes_no(val):
-                        st.session_state.step = 7
-                    else:
-                        st.session_state.step += 1
-                    st.rerun()
-        with col2:
-            if st.button("🔙 Back", key=f"back_{step}", use_container_width=True):
-                st.session_state.step = max(1, step - 1)
-                st.rerun()
-
-    elif step == 7:
-        val = st.text_input("Partner's First Name:", key="partner_first")
-        col1, col2 = st.columns([3, 1])
-        with col1:
-            if st.button("Submit", key="partner_first_submit", use_container_width=True):
-                v = val.strip()
-                if v:
-                    user_say(v)
-                    st.session_state.form["partner_first"] = v
-                    st.session_state.step = 8
-                    st.rerun()
-                else:
-                    st.warning("Enter partner first name.")
-        with col2:
-            if st.button("🔙 Back", key="back_partner_first", use_container_width=True):
-                st.session_state.step = 6
-                st.rerun()
-                
-    elif step == 8:
-        val = st.text_input("Partner's Last Name:", key="partner_last")
-        col1, col2 = st.columns([3, 1])
-        with col1:
-            if st.button("Submit", key="partner_last_submit", use_container_width=True):
-                v = val.strip()
-                if v:
-                    user_say(v)
-                    st.session_state.form["partner_last"] = v
-                    st.session_state.step = 9
-                    st.rerun()
-                else:
-                    st.warning("Enter partner last name.")
-        with col2:
-            if st.button("🔙 Back", key="back_partner_last", use_container_width=True):
-                st.session_state.step = 7
-                st.rerun()
-
-    elif step == 9:
-        st.write("Select Department:")
-        dept = st.selectbox("Departments", options=list(DUMMY_DATA.keys()), key="dept_select")
-        col1, col2 = st.columns([3, 1])
-        with col1:
-            if st.button("Select Department", key="dept_submit", use_container_width=True):
-                user_say(dept)
-                st.session_state.form["department"] = dept
-                st.session_state.step = 10
-                st.rerun()
-        with col2:
-            if st.button("🔙 Back", key="back_dept", use_container_width=True):
-                st.session_state.step = 8 if st.session_state.form.get("partner_included") and parse_yes_no(st.session_state.form.get("partner_included")) else 7
-                st.rerun()
-
-    elif step == 10:
-        dept = st.session_state.form.get("department")
-        doctors = [d["name"] for d in DUMMY_DATA.get(dept, [])]
-        doctor = st.selectbox("Available Doctors", options=doctors, key="doctor_select")
-        col1, col2 = st.columns([3, 1])
-        with col1:
-            if st.button("Choose Doctor", key="doctor_submit", use_container_width=True):
-                user_say(doctor)
-                st.session_state.form["doctor"] = doctor
-                st.session_state.step = 11
-                st.rerun()
-        with col2:
-            if st.button("🔙 Back", key="back_doctor", use_container_width=True):
-                st.session_state.step = 9
-                st.rerun()
-
-    elif step == 11:
-        date_input = st.text_input("Preferred Date (DD/MM/YYYY)", key="date_input")
-        col1, col2 = st.columns([3, 1])
-        with col1:
-            if st.button("Submit Date", key="date_submit", use_container_width=True):
-                v = date_input.strip()
-                try:
-                    datetime.strptime(v, "%d/%m/%Y")
-                    user_say(v)
-                    st.session_state.form["date"] = v
-                    st.session_state.step = 12
-                    st.rerun()
-                except:
-                    st.warning("Invalid date format. Use DD/MM/YYYY")
-        with col2:
-            if st.button("🔙 Back", key="back_date", use_container_width=True):
-                st.session_state.step = 10
-                st.rerun()
-
-    elif step == 12:
-        dept = st.session_state.form.get("department")
-        doctor = st.session_state.form.get("doctor")
-        slots = []
-        for d in DUMMY_DATA.get(dept, []):
-            if d["name"] == doctor:
-                slots = d["slots"]
-                break
-        if not slots:
-            st.write("No slots available. Please choose another doctor.")
-            if st.button("Choose another doctor"):
-                st.session_state.step = 10
-                st.rerun()
-        else:
-            slot = st.selectbox("Choose a time slot", options=slots, key="slot_select")
-            col1, col2 = st.columns([3, 1])
-            with col1:
-                if st.button("Select slot", key="slot_submit", use_container_width=True):
-                    user_say(slot)
-                    st.session_state.form["time_slot"] = slot
-                    st.session_state.step = 13
-                    st.rerun()
-            with col2:
-                if st.button("🔙 Back", key="back_slot", use_container_width=True):
-                    st.session_state.step = 11
-                    st.rerun()
+    state = st.session_state.booking
+    step = state["step"]
+    shown = booking_flow.prompt(state, booking_options)
+    options = shown.get("options", [])
 
-    elif step == 13:
-        reason = st.text_area("Reason for appointment (brief):", key="reason_input")
-        col1, col2 = st.columns([3, 1])
-        with col1:
-            if st.button("Submit Reason", key="reason_submit", use_container_width=True):
-                v = reason.strip()
-                user_say(v)
-                st.session_state.form["reason"] = v
-                st.session_state.step = 14
-                st.rerun()
-        with col2:
-            if st.button("🔙 Back", key="back_reason", use_container_width=True):
-                st.session_state.step = 12
-                st.rerun()
-
-    elif step == 14:
-        form = st.session_state.form
+    if shown["kind"] == "summary":
+        form = state["form"]
         st.markdown("### 📋 Appointment Summary")
+        import pandas as pd
         summary_df = pd.DataFrame([form]).T.rename(columns={0: "Value"})
         st.dataframe(summary_df, use_container_width=True)
         
@@ -545,71 +572,97 @@ elif st.session_state.current_menu == "appointment":
         with col1:
             if st.button("✅ Confirm Appointment", type="primary", use_container_width=True):
                 user_say("Confirm appointment")
+                state, _, _ = booking_flow.advance(state, {"action": "confirm"})
                 
-                # Generate confirmation message using EURI
+                # Save to the appointment store
+                record = booking_flow.booking_record(form)
                 try:
-                    prompt = f"""Create a warm, professional confirmation message for a fertility clinic appointment. 
+                    committer.commit(record)
+                except SlotTaken:
+                    state, _, errors = booking_flow.slot_taken(state)
+                    bot_say(errors[0])
+                    st.session_state.booking = state
+                    st.rerun()
+                except AlreadyBooked:
+                    pass
+
+                # Generate confirmation message using EURI
+                prompt = f"""Create a warm, professional confirmation message for a fertility clinic appointment. 
                     Include: patient name, doctor, date/time, and a reassuring tone. Keep it to 3-4 sentences and also include Thank you for connecting with Avenir Fertility! 
                     Our team will reach out soon. 
                     Would you like to receive fertility tips, treatment updates, and success stories on WhatsApp? 
                     (Yes/No) .
                     
                     Details: {form}"""
-                    resp = client.generate_completion(prompt=prompt, temperature=0.2, max_tokens=200)
-                    confirmation_msg = resp.get("choices", [{}])[0].get("message", {}).get("content", "")
-                except:
-                    confirmation_msg = f"Thank you {form.get('first_name', '')}! Your appointment with {form.get('doctor', '')} on {form.get('date', '')} at {form.get('time_slot', '')} has been confirmed. We look forward to seeing you! Warm regards, Avenir Fertility Clinic"
-                
-                # Save to CSV
-                record = {
-                    "first_name": form.get("first_name",""),
-                    "last_name": form.get("last_name",""),
-                    "sex": form.get("sex",""),
-                    "mobile": form.get("mobile",""),
-                    "dob": form.get("dob",""),
-                    "email": form.get("email",""),
-                    "partner_included": parse_yes_no(form.get("partner_included","no")),
-                    "partner_first": form.get("partner_first",""),
-                    "partner_last": form.get("partner_last",""),
-                    "department": form.get("department",""),
-                    "doctor": form.get("doctor",""),
-                    "date": form.get("date",""),
-                    "time_slot": form.get("time_slot",""),
-                    "reason": form.get("reason",""),
-                    "summary": "Appointment booked via chatbot",
-                    "created_at": datetime.now().isoformat()
-                }
-                df = pd.read_csv(APPT_CSV)
-                df = pd.concat([df, pd.DataFrame([record])], ignore_index=True)
-                df.to_csv(APPT_CSV, index=False)
-
-                # POST to API
-                try:
-                    r = requests.post(API_BACKEND, json=record, timeout=5)
-                    if r.status_code in (200,201):
-                        st.success("✅ Appointment saved successfully!")
-                    else:
-                        st.warning("Appointment saved locally but API returned an error.")
-                except:
-                    st.success("✅ Appointment saved locally!")
-
-                bot_say(confirmation_msg)
-                st.session_state.step = 0
-                st.session_state.form = {}
+                fallback = f"Thank you {form.get('first_name', '')}! Your appointment with {form.get('doctor', '')} on {form.get('date', '')} at {form.get('time_slot', '')} has been confirmed. We look forward to seeing you! Warm regards, Avenir Fertility Clinic"
+                chunks = llm.stream(prompt, temperature=0.2, max_tokens=200, cache=False, fallback=fallback, menu="appointment")
+
+                # The booking is durable now; the confirmation text and the API
+                # sync run in the background and show up when ready
+                st.session_state.pending_confirmation = pipeline.dispatch(record, chunks)
+                st.session_state.booking = None
                 st.session_state.current_menu = "main"
                 st.rerun()
         
         with col2:
             if st.button("✏️ Edit Details", use_container_width=True):
                 user_say("Edit appointment details")
-                st.session_state.step = 1
-                st.rerun()
+                booking_input(state, {"action": "goto", "value": 1})
         
         with col3:
             if st.button("❌ Cancel", use_container_width=True):
                 user_say("Cancel appointment")
                 st.info("Appointment cancelled.")
-                st.session_state.step = 0
-                st.session_state.form = {}
+                st.session_state.booking = None
                 st.session_state.current_menu = "main"
-                st.rerun()
\ No newline at end of file
+                st.rerun()
+
+    elif shown["kind"] == "choice" and not options:
+        st.write(shown.get("message", "No options available."))
+        if st.button("Choose another doctor"):
+            booking_input(state, {"action": "goto", "value": 10})
+
+    else:
+        if shown["kind"] == "choice":
+            value = st.selectbox(shown["question"], options=options, key=f"select_{step}")
+        elif shown["kind"] == "textarea":
+            value = st.text_area(shown["question"], key=f"input_{step}")
+        else:
+            value = st.text_input(shown["question"], key=f"input_{step}")
+        col1, col2 = st.columns([3, 1])
+        with col1:
+            if st.button(SUBMIT_LABELS.get(step, "Submit"), key=f"submit_{step}", use_container_width=True):
+                booking_input(state, value or "", options)
+        with col2:
+            if st.button("🔙 Back", key=f"back_{step}", use_container_width=True):
+                booking_input(state, {"action": "back"})
+
+save_session()
+
+# ---------- Timing report ----------
+# Cold-start import time of this process, and how long complete runs take
+# (runs cut short by st.rerun() aren't counted)
+RERUN_SECONDS = metrics.histogram("streamlit_run_seconds", "Time to execute the script once, by menu", ("menu",))
+metrics.gauge("streamlit_cold_import_seconds", "Module import time of the first run", lambda: timings["cold_import"])
+
+@st.cache_resource(show_spinner=False)
+def get_timings():
+    return {"cold_import": IMPORT_SECONDS, "runs": collections.deque(maxlen=500)}
+
+def timing_report(timings, imports, run):
+    runs = sorted(timings["runs"])
+    pick = lambda q: round(runs[min(len(runs) - 1, int(q * len(runs)))] * 1000, 1)
+    return {
+        "cold_import_ms": round(timings["cold_import"] * 1000, 1),
+        "this_run": {"imports_ms": round(imports * 1000, 1), "total_ms": round(run * 1000, 1)},
+        "recent_runs": {"n": len(runs), "p50_ms": pick(0.5), "p95_ms": pick(0.95)},
+    }
+
+timings = get_timings()
+run_seconds = time.perf_counter() - RUN_STARTED
+timings["runs"].append(run_seconds)
+RERUN_SECONDS.observe(run_seconds, menu=st.session_state.current_menu)
+if SHOW_DIAGNOSTICS:
+    with timing_slot.container():
+        with st.expander("⏱️ Startup and rerun timing"):
+            st.json(timing_report(timings, IMPORT_SECONDS, run_seconds))
\ No newline at end of file
@@ -0,0 +1,82 @@
+# test_booking_pipeline.py
+import pytest
+from booking_pipeline import BookingPipeline, Outbox, SYNCED, QUEUED, REJECTED
+
+RECORD = {"first_name": "Ann", "doctor": "Dr. Priya Nair", "date": "20/10/2026", "time_slot": "10:00 AM"}
+
+
+class Response:
+    def __init__(self, status, body=None):
+        self.status_code = status
+        self.text = "" if body is None else str(body)
+        self.body = body
+
+    def json(self):
+        return self.body
+
+# Stand-in for the httpx client: answers with the queued responses (an
+# exception is raised instead) and records what was posted
+class FakeAPI:
+    def __init__(self, *responses):
+        self.responses = list(responses)
+        self.posts = []
+
+    def post(self, url, json=None, timeout=None):
+        self.posts.append((url, json))
+        response = self.responses.pop(0)
+        if isinstance(response, Exception):
+            raise response
+        return response
+
+@pytest.fixture
+def outbox(tmp_path):
+    return Outbox(str(tmp_path / "outbox.sqlite3"), base_delay=0.0)
+
+def pipeline(outbox, *responses):
+    return BookingPipeline("http://api/api/appointments", outbox, client=FakeAPI(*responses))
+
+
+# ---------- Sync ----------
+def test_booking_is_in_the_outbox_while_it_is_posted(outbox):
+    seen = []
+    api = FakeAPI(Response(201))
+    post = api.post
+    api.post = lambda *args, **kwargs: (seen.append(outbox.pending()), post(*args, **kwargs))[1]
+    p = BookingPipeline("http://api/api/appointments", outbox, client=api)
+    assert p.dispatch(RECORD).sync.result(5) == SYNCED
+    assert seen == [1]
+    assert outbox.pending() == 0
+
+def test_in_flight_booking_is_not_due_yet(outbox):
+    outbox.add(RECORD, delay=60)
+    assert outbox.due() == []
+    assert outbox.pending() == 1
+
+def test_transient_failure_stays_queued(outbox):
+    p = pipeline(outbox, ConnectionError("down"))
+    assert p.dispatch(RECORD).sync.result(5) == QUEUED
+    (row_id, record, attempts), = outbox.due()
+    assert record == RECORD and attempts == 1
+
+def test_server_error_stays_queued_and_rejection_is_dropped(outbox):
+    assert pipeline(outbox, Response(503, "busy")).dispatch(RECORD).sync.result(5) == QUEUED
+    assert pipeline(outbox, Response(422, "bad")).dispatch(RECORD).sync.result(5) == REJECTED
+    assert outbox.pending() == 1
+
+
+# ---------- Drain ----------
+def test_drain_posts_due_rows_in_one_bulk_request(outbox):
+    for i in range(3):
+        outbox.retry(outbox.add(dict(RECORD, n=i)), 0, "down")
+    results = [{"index": i, "status": s} for i, s in enumerate(["created", "duplicate", "conflict"])]
+    p = pipeline(outbox, Response(200, {"results": results}))
+    assert p.drain() == 3
+    (url, body), = p.client.posts
+    assert url.endswith("/bulk") and [r["n"] for r in body] == [0, 1, 2]
+    assert outbox.pending() == 0
+
+def test_failed_drain_keeps_the_rows(outbox):
+    outbox.retry(outbox.add(RECORD), 0, "down")
+    p = pipeline(outbox, ConnectionError("still down"))
+    assert p.drain() == 1
+    assert outbox.pending() == 1
@@ -0,0 +1,126 @@
+# test_group_commit.py
+import asyncio
+import threading
+import pytest
+from appointment_store import JsonlLogStore
+from group_commit import GroupCommitter
+
+
+@pytest.fixture
+def store(tmp_path):
+    return JsonlLogStore(str(tmp_path / "appointments.jsonl"))
+
+# A check that holds the batch holding a {"slow": True} record until released
+def gated():
+    gate = threading.Event()
+    def check(record, accepted):
+        if record.get("slow"):
+            gate.wait(5)
+    return gate, check
+
+
+# A store that counts append_many() calls
+class CountingStore(JsonlLogStore):
+    appends = 0
+
+    def append_many(self, records, stamp=True):
+        self.appends += 1
+        return super().append_many(records, stamp)
+
+def reject_odd(record, accepted):
+    if record["n"] % 2:
+        raise ValueError(f"odd: {record['n']}")
+
+
+# ---------- Batching ----------
+def test_records_submitted_together_are_one_durable_batch(tmp_path):
+    store = CountingStore(str(tmp_path / "appointments.jsonl"))
+    committer = GroupCommitter(store)
+    futures = committer.submit_many([{"n": i} for i in range(10)])
+    locs = [f.result(5) for f in futures]
+    committer.close()
+    assert store.appends == 1
+    assert locs == sorted(set(locs))
+    # Acknowledged means on disk: a fresh reader sees every record
+    reread = JsonlLogStore(store.path)
+    assert [reread.read_at(loc)["n"] for loc in locs] == list(range(10))
+
+def test_commit_returns_the_locator(store):
+    committer = GroupCommitter(store)
+    loc = committer.commit({"n": 1}, timeout=5)
+    assert store.read_at(loc)["n"] == 1
+    assert asyncio.run(committer.commit_async({"n": 2})) > loc
+    committer.close()
+
+def test_failed_check_rejects_only_that_record(store):
+    committer = GroupCommitter(store, checks=[reject_odd])
+    futures = committer.submit_many([{"n": i} for i in range(4)])
+    for i, f in enumerate(futures):
+        if i % 2:
+            with pytest.raises(ValueError):
+                f.result(5)
+        else:
+            assert f.result(5) is not None
+    committer.close()
+    assert [r["n"] for _, r in store.scan()] == [0, 2]
+
+def test_checks_see_records_accepted_earlier_in_the_batch(store):
+    seen = []
+    committer = GroupCommitter(store, checks=[lambda record, accepted: seen.append([r["n"] for r in accepted])])
+    for f in committer.submit_many([{"n": i} for i in range(3)]):
+        f.result(5)
+    committer.close()
+    assert seen == [[], [0], [0, 1]]
+
+def test_failed_write_fails_the_batch_and_the_writer_carries_on(store, monkeypatch):
+    committer = GroupCommitter(store)
+    def disk_full(records, stamp=True):
+        raise OSError("disk full")
+    monkeypatch.setattr(store, "append_many", disk_full)
+    with pytest.raises(OSError):
+        committer.commit({"n": 1}, timeout=5)
+    monkeypatch.undo()
+    assert store.read_at(committer.commit({"n": 2}, timeout=5))["n"] == 2
+    committer.close()
+
+
+# ---------- Cancelled waiters ----------
+def test_waiter_cancelled_before_its_batch_is_dropped(store):
+    gate, check = gated()
+    committer = GroupCommitter(store, checks=[check])
+
+    async def main():
+        first = asyncio.ensure_future(committer.commit_async({"n": 1, "slow": True}))
+        await asyncio.sleep(0.05)
+        second = asyncio.ensure_future(committer.commit_async({"n": 2}))
+        await asyncio.sleep(0.05)
+        second.cancel()
+        gate.set()
+        await first
+        with pytest.raises(asyncio.CancelledError):
+            await second
+        await asyncio.wait_for(committer.commit_async({"n": 3}), 5)
+
+    asyncio.run(main())
+    assert [r["n"] for _, r in store.scan()] == [1, 3]
+    assert committer._thread.is_alive()
+    committer.close()
+
+def test_waiter_cancelled_during_its_batch_keeps_the_writer_alive(store):
+    gate, check = gated()
+    committer = GroupCommitter(store, checks=[check])
+
+    async def main():
+        first = asyncio.ensure_future(committer.commit_async({"n": 1, "slow": True}))
+        await asyncio.sleep(0.05)
+        first.cancel()
+        gate.set()
+        with pytest.raises(asyncio.CancelledError):
+            await first
+        await asyncio.wait_for(committer.commit_async({"n": 2}), 5)
+
+    asyncio.run(main())
+    # The batch had started, so the record was still written
+    assert [r["n"] for _, r in store.scan()] == [1, 2]
+    assert committer._thread.is_alive()
+    committer.close()
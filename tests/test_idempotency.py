@@ -0,0 +1,79 @@
+# test_idempotency.py
+import pytest
+from appointment_store import JsonlLogStore
+from group_commit import GroupCommitter
+from idempotency import IdempotencyIndex, DuplicateRequest, fingerprint, without_key, KEY_FIELD
+
+APPT = {"first_name": "Ann", "last_name": "Lee", "mobile": "555", "doctor": "Dr. Priya Nair",
+        "date": "20/10/2026", "time_slot": "10:00 AM"}
+
+def keyed(key, **changes):
+    return {**APPT, **changes, KEY_FIELD: key}
+
+@pytest.fixture
+def store(tmp_path):
+    return JsonlLogStore(str(tmp_path / "a.jsonl"))
+
+def open_writer(store, **index_args):
+    index = IdempotencyIndex(**index_args)
+    store.add_listener(index)
+    store.load()
+    return index, GroupCommitter(store, checks=[index.check])
+
+
+# ---------- Replays ----------
+def test_replay_with_the_same_payload(store):
+    index, committer = open_writer(store)
+    committer.commit(keyed("k1"), timeout=5)
+    with pytest.raises(DuplicateRequest) as e:
+        index.lookup(keyed("k1"))
+    assert e.value.same_payload
+    with pytest.raises(DuplicateRequest):
+        committer.commit(keyed("k1"), timeout=5)
+    committer.close()
+    assert len(list(store.scan())) == 1
+
+def test_key_reused_for_a_different_payload(store):
+    index, committer = open_writer(store)
+    committer.commit(keyed("k1"), timeout=5)
+    with pytest.raises(DuplicateRequest) as e:
+        committer.commit(keyed("k1", time_slot="11:00 AM"), timeout=5)
+    assert not e.value.same_payload
+    committer.close()
+
+def test_same_key_twice_in_one_batch(store):
+    _, committer = open_writer(store)
+    first, replay, changed = committer.submit_many([keyed("k1"), keyed("k1"), keyed("k1", mobile="556")])
+    assert first.result(5) is not None
+    with pytest.raises(DuplicateRequest) as e:
+        replay.result(5)
+    assert e.value.same_payload
+    with pytest.raises(DuplicateRequest) as e:
+        changed.result(5)
+    assert not e.value.same_payload
+    committer.close()
+
+def test_keys_are_rebuilt_from_the_store(store):
+    _, committer = open_writer(store)
+    committer.commit(keyed("k1"), timeout=5)
+    committer.close()
+    restarted, _ = open_writer(JsonlLogStore(store.path))
+    assert restarted.get("k1") == fingerprint(keyed("k1"))
+
+def test_expired_keys_are_forgotten(store):
+    index, committer = open_writer(store, ttl=-1)
+    committer.commit(keyed("k1"), timeout=5)
+    committer.close()
+    assert index.get("k1") is None
+    index.lookup(keyed("k1"))
+
+
+# ---------- Fingerprints ----------
+def test_fingerprint_ignores_store_fields_and_date_format():
+    stored = {**APPT, "date": "2026-10-20", "created_at": "2026-10-01T09:00:00", "type": "appointment", KEY_FIELD: "x"}
+    assert fingerprint(APPT) == fingerprint(stored)
+    assert fingerprint(APPT) != fingerprint({**APPT, "mobile": "556"})
+
+def test_without_key():
+    assert without_key(keyed("k1")) == APPT
+    assert KEY_FIELD in keyed("k1")
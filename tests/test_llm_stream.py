@@ -0,0 +1,141 @@
+# test_llm_stream.py
+import threading
+from llm_client import LLMClient, CircuitBreaker, FakeEuriaiClient
+
+TEXT = "one two three four five six seven"
+
+
+def make_llm(**fake):
+    client = FakeEuriaiClient(text=TEXT, chunk_size=5, **fake)
+    return LLMClient(client, breaker=CircuitBreaker(failure_threshold=1, reset_timeout=0)), client
+
+
+# ---------- Streaming ----------
+def test_chunks_arrive_in_order():
+    llm, _ = make_llm()
+    chunks = list(llm.stream("hello", timeout=2))
+    assert len(chunks) > 1
+    assert "".join(chunks) == TEXT
+    assert llm.breaker.state == "closed"
+
+def test_failure_before_first_chunk_yields_fallback():
+    llm, _ = make_llm(fail=True)
+    assert list(llm.stream("hello", timeout=2, fallback="sorry")) == ["sorry"]
+    assert llm.fallbacks == 1
+    assert llm.breaker.failures == 1
+
+def test_slow_first_chunk_yields_fallback():
+    llm, _ = make_llm(latency=0.5)
+    assert list(llm.stream("hello", timeout=0.1, fallback="sorry")) == ["sorry"]
+    # The reader's deadline and the client's HTTP timeout are the same; either
+    # may fire first, and the call counts as one failure
+    assert llm.breaker.failures == 1
+
+def test_mid_stream_timeout_ends_stream():
+    llm, _ = make_llm(chunk_delay=0.5)
+    chunks = list(llm.stream("hello", timeout=0.1, fallback="sorry"))
+    assert chunks == [TEXT[:5]]
+    assert llm.timeouts_hit == 1
+    assert llm.fallbacks == 0
+    assert llm.breaker.failures == 1
+    # A cut-off answer is not cached
+    assert len(llm.cache) == 0
+
+
+# ---------- Caching ----------
+def test_joined_text_is_cached():
+    llm, client = make_llm()
+    list(llm.stream("hello", timeout=2))
+    assert list(llm.stream("hello", timeout=2)) == [TEXT]
+    assert llm.complete("hello") == TEXT
+    assert client.calls == 1
+
+def test_uncached_stream_calls_upstream_again():
+    llm, client = make_llm()
+    list(llm.stream("hello", timeout=2, cache=False))
+    list(llm.stream("hello", timeout=2, cache=False))
+    assert client.calls == 2
+
+
+# ---------- Coalescing ----------
+def read_concurrently(llm, n, **kwargs):
+    results = [None] * n
+    def read(i):
+        results[i] = "".join(llm.stream("hello", timeout=2, **kwargs))
+    threads = [threading.Thread(target=read, args=(i,)) for i in range(n)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join(5)
+    return results
+
+def test_concurrent_streams_share_one_upstream_call():
+    llm, client = make_llm(latency=0.1, chunk_delay=0.01)
+    assert read_concurrently(llm, 6) == [TEXT] * 6
+    assert client.calls == 1
+    assert llm.upstream_calls == 1
+    assert llm.deduplicated == 5
+
+def test_late_follower_replays_chunks_already_streamed():
+    llm, client = make_llm(chunk_delay=0.05)
+    leader = llm.stream("hello", timeout=2)
+    first = [next(leader), next(leader)]
+    follower = "".join(llm.stream("hello", timeout=2))
+    assert follower == TEXT
+    assert "".join(first + list(leader)) == TEXT
+    assert client.calls == 1
+
+def test_reader_leaving_does_not_stop_the_others():
+    llm, client = make_llm(chunk_delay=0.02)
+    leader = llm.stream("hello", timeout=2)
+    follower = llm.stream("hello", timeout=2)
+    next(leader)
+    next(follower)
+    leader.close()
+    assert TEXT[:5] + "".join(follower) == TEXT
+    assert list(llm.stream("hello", timeout=2)) == [TEXT]
+    assert client.calls == 1
+
+def test_shared_failure_falls_back_for_everyone_and_counts_once():
+    llm, client = make_llm(latency=0.1, fail=True)
+    llm.breaker.failure_threshold = 3
+    assert read_concurrently(llm, 4, fallback="sorry") == ["sorry"] * 4
+    assert client.calls == 1
+    assert llm.breaker.failures == 1
+    assert llm.fallbacks == 4
+
+
+# ---------- Circuit breaker ----------
+def trip(llm, client):
+    client.fail = True
+    list(llm.stream("trip", timeout=2, fallback="sorry"))
+    client.fail = False
+    assert llm.breaker.state == "half_open"
+
+def test_abandoned_probe_settles_breaker():
+    llm, client = make_llm(chunk_delay=0.01)
+    trip(llm, client)
+    stream = llm.stream("hello", timeout=2)
+    assert next(stream) == TEXT[:5]
+    stream.close()
+    assert llm.breaker.state == "closed"
+    assert llm.breaker.allow()
+
+def test_released_probe_lets_next_call_probe():
+    llm, client = make_llm()
+    trip(llm, client)
+    assert llm.breaker.allow()
+    assert not llm.breaker.allow()
+    llm.breaker.release()
+    assert "".join(llm.stream("hello", timeout=2)) == TEXT
+    assert llm.breaker.state == "closed"
+
+def test_open_breaker_streams_fallback_without_upstream_call():
+    llm, client = make_llm()
+    llm.breaker.reset_timeout = 60
+    trip_calls = client.calls
+    client.fail = True
+    list(llm.stream("trip", timeout=2, fallback="sorry"))
+    assert llm.breaker.state == "open"
+    assert list(llm.stream("hello", timeout=2, fallback="sorry")) == ["sorry"]
+    assert client.calls == trip_calls + 1
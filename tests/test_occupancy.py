@@ -0,0 +1,90 @@
+# test_occupancy.py
+import multiprocessing
+import pytest
+from appointment_store import JsonlLogStore
+from group_commit import GroupCommitter
+from occupancy import OccupancyIndex, SlotTaken, AlreadyBooked
+
+SLOT = {"doctor": "Dr. Priya Nair", "date": "20/10/2026", "time_slot": "10:00 AM"}
+
+def booking(first_name, mobile, **slot):
+    return {"first_name": first_name, "last_name": "Lee", "mobile": mobile, **SLOT, **slot}
+
+# One "process": its own store handle, index and writer on a shared log
+def open_writer(path):
+    store = JsonlLogStore(path)
+    occupancy = OccupancyIndex()
+    store.add_listener(occupancy)
+    store.load()
+    return store, occupancy, GroupCommitter(store, checks=[occupancy.check])
+
+
+# ---------- Within a batch ----------
+def test_second_booking_of_a_slot_in_the_same_batch_is_rejected(tmp_path):
+    store, occupancy, committer = open_writer(str(tmp_path / "a.jsonl"))
+    first, second, other = committer.submit_many([
+        booking("Ann", "555-0101"),
+        booking("Bob", "555-0202"),
+        booking("Cat", "555-0303", time_slot="11:00 AM"),
+    ])
+    assert first.result(5) is not None
+    with pytest.raises(SlotTaken):
+        second.result(5)
+    assert other.result(5) is not None
+    committer.close()
+    assert occupancy.taken_slots("Dr. Priya Nair", "2026-10-20") == {"10:00 AM", "11:00 AM"}
+    assert [r["first_name"] for _, r in store.scan()] == ["Ann", "Cat"]
+
+def test_same_patient_again_in_the_same_batch_is_already_booked(tmp_path):
+    _, _, committer = open_writer(str(tmp_path / "a.jsonl"))
+    # The holder is matched on digits of the mobile and the name, any case
+    first, again = committer.submit_many([booking("Ann", "555-0101"), booking("ANN", "5550101", time_slot="10:00 am")])
+    assert first.result(5) is not None
+    with pytest.raises(AlreadyBooked):
+        again.result(5)
+    committer.close()
+
+def test_callbacks_and_undated_records_hold_no_slot(tmp_path):
+    _, occupancy, committer = open_writer(str(tmp_path / "a.jsonl"))
+    for f in committer.submit_many([{"type": "expert_callback", **SLOT}, booking("Ann", "1", date="")]):
+        f.result(5)
+    committer.close()
+    assert not occupancy.is_taken(SLOT["doctor"], SLOT["date"], SLOT["time_slot"])
+
+
+# ---------- Across processes ----------
+def test_booking_written_by_another_writer_is_seen_under_the_lock(tmp_path):
+    path = str(tmp_path / "a.jsonl")
+    _, _, one = open_writer(path)
+    _, other_index, two = open_writer(path)
+    one.commit(booking("Ann", "555-0101"), timeout=5)
+    # The second writer's index hasn't seen it; the check runs after the
+    # store caught up under the file lock
+    with pytest.raises(SlotTaken):
+        two.commit(booking("Bob", "555-0202"), timeout=5)
+    assert other_index.is_taken(SLOT["doctor"], SLOT["date"], SLOT["time_slot"])
+    one.close()
+    two.close()
+
+def _book(path, name, results):
+    _, _, committer = open_writer(path)
+    try:
+        committer.commit(booking(name, name), timeout=30)
+        results.put("created")
+    except SlotTaken:
+        results.put("taken")
+    committer.close()
+
+def test_concurrent_processes_book_a_slot_once(tmp_path):
+    path = str(tmp_path / "a.jsonl")
+    JsonlLogStore(path)
+    ctx = multiprocessing.get_context("fork")
+    results = ctx.Queue()
+    procs = [ctx.Process(target=_book, args=(path, f"p{i}", results)) for i in range(6)]
+    for p in procs:
+        p.start()
+    for p in procs:
+        p.join(60)
+    outcomes = sorted(results.get(timeout=5) for _ in procs)
+    assert outcomes == ["created"] + ["taken"] * 5
+    assert len(list(JsonlLogStore(path).scan())) == 1
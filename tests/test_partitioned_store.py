@@ -0,0 +1,73 @@
+# test_partitioned_store.py
+import pytest
+from appointment_store import PartitionedStore
+import appointment_store
+
+pytest.importorskip("pyarrow")
+pytest.importorskip("pandas")
+
+
+@pytest.fixture(autouse=True)
+def small_row_groups(monkeypatch):
+    # Several row groups per archived month
+    monkeypatch.setattr(appointment_store, "ARCHIVE_ROW_GROUP", 50)
+
+def records(n, month):
+    return [{"first_name": f"p{i}", "date": f"{1 + i % 28:02d}/{month:02d}/2025", "n": i} for i in range(n)]
+
+def reopen(store):
+    fresh = PartitionedStore(store.root)
+    fresh.load()
+    return fresh
+
+
+# ---------- Archiving ----------
+def test_locators_survive_archiving(tmp_path):
+    store = PartitionedStore(str(tmp_path / "appointments"))
+    locs = store.append_many(records(200, 1) + records(120, 2) + records(10, 3))
+    before = list(store.scan())
+    assert store.archive("2025-03") == ["2025-01", "2025-02"]
+    for s in (store, reopen(store)):
+        assert list(s.scan()) == before
+        assert [s.read_at(loc) for loc in locs] == [r for _, r in before]
+
+def test_late_booking_for_an_archived_month(tmp_path):
+    store = PartitionedStore(str(tmp_path / "appointments"))
+    locs = store.append_many(records(100, 1))
+    store.archive("2025-02")
+    late = store.append({"first_name": "late", "date": "15/01/2025"})
+    assert late[0] == "2025-01" and late[1] > max(off for _, off in locs)
+    assert store.read_at(late)["first_name"] == "late"
+    # Folding the late log into the archive keeps every locator
+    store.archive("2025-02")
+    fresh = reopen(store)
+    assert fresh.read_at(late)["first_name"] == "late"
+    assert [fresh.read_at(loc)["n"] for loc in locs] == list(range(100))
+
+def test_scan_resumes_from_an_archived_locator(tmp_path):
+    store = PartitionedStore(str(tmp_path / "appointments"))
+    locs = store.append_many(records(200, 1))
+    store.archive("2025-02")
+    resumed = [loc for loc, _ in store.scan(locs[123])]
+    assert resumed == [tuple(loc) for loc in locs[123:]]
+
+def test_listeners_replay_archived_months(tmp_path):
+    store = PartitionedStore(str(tmp_path / "appointments"))
+    locs = store.append_many(records(80, 1) + records(5, 4))
+    store.archive("2025-04")
+    seen = []
+    fresh = PartitionedStore(store.root)
+    fresh.add_listener(seen.extend)
+    fresh.load()
+    assert sorted(loc for loc, _ in seen) == sorted(tuple(loc) for loc in locs)
+
+def test_valid_locator(tmp_path):
+    store = PartitionedStore(str(tmp_path / "appointments"))
+    locs = store.append_many(records(60, 1) + records(3, 2))
+    store.archive("2025-02")
+    assert all(store.valid_locator(list(loc)) for loc in locs)
+    assert store.valid_locator(["2025-02", locs[-1][1]])
+    assert not store.valid_locator(["2025-02", locs[-1][1] + 1])
+    assert not store.valid_locator(["1999-01", 0])
+    assert not store.valid_locator(["2025-01", -1])
+    assert not store.valid_locator(123)
@@ -0,0 +1,44 @@
+# test_snapshot.py
+import json
+import snapshot
+from snapshot import ListingSnapshot
+from idempotency import KEY_FIELD
+
+def read(listing):
+    etag, length, parts = listing.body()
+    body = b"".join(parts)
+    assert len(body) == length
+    return etag, json.loads(body)
+
+def entries(*records):
+    return list(enumerate(records))
+
+
+def test_empty_listing():
+    assert read(ListingSnapshot())[1] == []
+
+def test_commits_are_appended_without_keys_or_callbacks():
+    listing = ListingSnapshot()
+    listing(entries({"n": 1, KEY_FIELD: "k"}, {"n": 2, "type": "callback"}))
+    listing(entries({"n": 3}, {"n": 4}))
+    assert read(listing)[1] == [{"n": 1}, {"n": 3}, {"n": 4}]
+    assert len(listing) == 3
+
+def test_body_stays_at_its_version(monkeypatch):
+    monkeypatch.setattr(snapshot, "WRITE_SIZE", 16)
+    listing = ListingSnapshot()
+    for i in range(20):
+        listing(entries({"n": i}))
+    etag, length, parts = listing.body()
+    first = next(parts)
+    listing(entries({"n": 20}))
+    body = first + b"".join(parts)
+    assert len(body) == length
+    assert [r["n"] for r in json.loads(body)] == list(range(20))
+    assert listing.etag != etag and read(listing)[1][-1] == {"n": 20}
+
+def test_etag_only_changes_with_rows():
+    listing = ListingSnapshot()
+    etag = listing.etag
+    listing(entries({"n": 1, "type": "callback"}))
+    assert listing.etag == etag